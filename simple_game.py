@@ -1,59 +1,234 @@
 import pygame
 import sys
 
-# Initialize Pygame
-pygame.init()
+import numpy as np
 
 # Set up the display
 width, height = 800, 600
-screen = pygame.display.set_mode((width, height))
-pygame.display.set_caption("Simple Pygame Game")
 
 # Colors
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
 RED = (255, 0, 0)
+GREEN = (0, 255, 0)
 BLUE = (0, 0, 255)
+YELLOW = (255, 255, 0)
+CYAN = (0, 255, 255)
+MAGENTA = (255, 0, 255)
 
 # Player properties
 player_size = 50
-player_x = width // 2 - player_size // 2
-player_y = height - 2 * player_size
 player_speed = 5
 
-# Game loop
-clock = pygame.time.Clock()
-running = True
-
-while running:
-    # Event handling
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-    
-    # Get keyboard input
-    keys = pygame.key.get_pressed()
-    if keys[pygame.K_LEFT] and player_x > 0:
-        player_x -= player_speed
-    if keys[pygame.K_RIGHT] and player_x < width - player_size:
-        player_x += player_speed
-    if keys[pygame.K_UP] and player_y > 0:
-        player_y -= player_speed
-    if keys[pygame.K_DOWN] and player_y < height - player_size:
-        player_y += player_speed
-    
-    # Clear the screen
-    screen.fill(BLACK)
-    
-    # Draw the player
-    pygame.draw.rect(screen, BLUE, (player_x, player_y, player_size, player_size))
-    
-    # Update the display
-    pygame.display.flip()
-    
-    # Cap the frame rate
-    clock.tick(60)
-
-# Quit Pygame
-pygame.quit()
-sys.exit()
+# Entities: `python simple_game.py 20000` for a different count
+ENTITY_COUNT = 10000
+ENTITY_SIZES = (3, 4, 5, 6)
+ENTITY_COLORS = (RED, WHITE, GREEN, YELLOW, CYAN, MAGENTA)
+MIN_SPEED, MAX_SPEED = 20, 120  # pixels per second
+# Entities the player touches are sent off at this speed
+PUSH_SPEED = 240
+
+# Side of a spatial hash cell. It is at least the largest entity, so two
+# entities that overlap always sit in the same or neighbouring cells.
+CELL_SIZE = 8
+GRID_COLS = -(-width // CELL_SIZE)
+GRID_ROWS = -(-height // CELL_SIZE)
+CELL_COUNT = GRID_COLS * GRID_ROWS
+
+
+class Entities:
+    # Every entity's state lives in contiguous arrays, one row per entity, so a
+    # frame's movement, collisions and drawing are a few whole-array
+    # operations however many entities there are. surface is what draw()
+    # will draw on, which fixes the pixel format of the colours.
+    def __init__(self, count, surface, seed=0):
+        rng = np.random.default_rng(seed)
+        self.count = count
+        self.size = rng.choice(ENTITY_SIZES, count)
+        self.color = rng.integers(len(ENTITY_COLORS), size=count)
+        # Top-left corners may go as far as the screen edge minus the size
+        self.limit = np.array([width, height]) - self.size[:, None]
+        self.pos = rng.random((count, 2)) * self.limit
+        angle = rng.random(count) * 2 * np.pi
+        speed = rng.uniform(MIN_SPEED, MAX_SPEED, count)
+        self.vel = np.stack([np.cos(angle), np.sin(angle)], axis=1) * speed[:, None]
+
+        # Entities are drawn a size at a time: for each size, its entities and
+        # the pixel offsets and mapped colour of every pixel they cover
+        palette = np.array([surface.map_rgb(color) for color in ENTITY_COLORS], dtype=np.uint32)
+        self.draw_groups = []
+        for size in ENTITY_SIZES:
+            which = np.flatnonzero(self.size == size)
+            dy, dx = np.mgrid[0:size, 0:size]
+            colors = np.repeat(palette[self.color[which]], size * size)
+            self.draw_groups.append((which, dx.ravel(), dy.ravel(), colors))
+
+        self.order = None
+        self.cell_start = None
+
+    def move(self, dt):
+        # Step every entity and bounce it off the screen edges
+        pos = self.pos
+        vel = self.vel
+        pos += vel * dt
+        # Velocities point back inside rather than flipping, so an entity
+        # pushed past an edge can't get stuck there
+        vel[:] = np.where(pos < 0, np.abs(vel), np.where(pos > self.limit, -np.abs(vel), vel))
+        np.clip(pos, 0, self.limit, out=pos)
+
+    def build_hash(self):
+        # Sort entities by the cell their top-left corner is in, row by row; the
+        # entities of cell c are then order[cell_start[c]:cell_start[c + 1]]
+        cell = (self.pos // CELL_SIZE).astype(np.int64)
+        key = cell[:, 1] * GRID_COLS + cell[:, 0]
+        order = np.argsort(key, kind='stable')
+        self.order = order
+        self.cell_start = np.searchsorted(key[order], np.arange(CELL_COUNT + 1))
+        self.sorted_key = key[order]
+        self.sorted_x = self.pos[order, 0]
+        self.sorted_y = self.pos[order, 1]
+        self.sorted_size = self.size[order]
+
+    def collisions(self):
+        # Index arrays (i, j) of every overlapping pair, through the spatial hash.
+        # Each entity is tested against those after it in its own cell and the
+        # next, and those in the three cells below; either group is one run of
+        # the sorted order, so every pair is tested once and only once.
+        key = self.sorted_key
+        cell_start = self.cell_start
+        column = key % GRID_COLS
+        not_right = column < GRID_COLS - 1
+        same_row = (np.arange(1, self.count + 1), cell_start[key + 1 + not_right])
+        below = np.minimum(key + GRID_COLS, CELL_COUNT)
+        last_row = key >= CELL_COUNT - GRID_COLS
+        below_start = np.where(last_row, 0, cell_start[below - (column > 0)])
+        below_end = np.where(last_row, 0, cell_start[np.minimum(below + 1 + not_right, CELL_COUNT)])
+
+        x = self.sorted_x
+        y = self.sorted_y
+        size = self.sorted_size
+        first = []
+        second = []
+        for start, end in (same_row, (below_start, below_end)):
+            # Every entity paired with each member of its run, flattened
+            counts = np.maximum(end - start, 0)
+            i = np.repeat(np.arange(self.count), counts)
+            j = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - start, counts)
+            dx = x[j] - x[i]
+            dy = y[j] - y[i]
+            size_i = size[i]
+            size_j = size[j]
+            overlap = (dx < size_i) & (-dx < size_j) & (dy < size_i) & (-dy < size_j)
+            first.append(i[overlap])
+            second.append(j[overlap])
+        return self.order[np.concatenate(first)], self.order[np.concatenate(second)]
+
+    def bounce(self, i, j):
+        # Pairs that are still closing swap velocities, as equal masses would.
+        # An entity in several pairs at once takes one of its partners' velocities.
+        closing = ((self.vel[j] - self.vel[i]) * (self.pos[j] - self.pos[i])).sum(axis=1) < 0
+        i = i[closing]
+        j = j[closing]
+        swapped = self.vel[i]
+        self.vel[i] = self.vel[j]
+        self.vel[j] = swapped
+
+    def query(self, rect):
+        # Entities overlapping rect. The hash's cells are numbered row by row,
+        # so each row of cells under rect is one slice of the sorted order.
+        x0 = max(0, (rect.left - max(ENTITY_SIZES)) // CELL_SIZE)
+        x1 = min(GRID_COLS - 1, rect.right // CELL_SIZE)
+        y0 = max(0, (rect.top - max(ENTITY_SIZES)) // CELL_SIZE)
+        y1 = min(GRID_ROWS - 1, rect.bottom // CELL_SIZE)
+        if x0 > x1 or y0 > y1:
+            return np.zeros(0, dtype=np.int64)
+        cell_start = self.cell_start
+        candidates = np.concatenate([self.order[cell_start[y * GRID_COLS + x0]:cell_start[y * GRID_COLS + x1 + 1]]
+                                     for y in range(y0, y1 + 1)])
+        pos = self.pos[candidates]
+        size = self.size[candidates]
+        hit = ((pos[:, 0] < rect.right) & (pos[:, 0] + size > rect.left) &
+               (pos[:, 1] < rect.bottom) & (pos[:, 1] + size > rect.top))
+        return candidates[hit]
+
+    def push(self, which, center):
+        # Send entities directly away from a point
+        away = self.pos[which] + self.size[which, None] / 2 - center
+        length = np.maximum(np.hypot(away[:, 0], away[:, 1]), 1e-6)
+        self.vel[which] = away / length[:, None] * PUSH_SPEED
+
+    def update(self, dt, player_rect):
+        self.move(dt)
+        self.build_hash()
+        self.bounce(*self.collisions())
+        self.push(self.query(player_rect), player_rect.center)
+
+    def draw(self, surface):
+        # Written straight into the surface's pixels, one scatter per entity size
+        pixels = pygame.surfarray.pixels2d(surface)
+        pos = self.pos.astype(np.int64)
+        for which, dx, dy, colors in self.draw_groups:
+            corner = pos[which]
+            pixels[(corner[:, 0, None] + dx).ravel(), (corner[:, 1, None] + dy).ravel()] = colors
+        del pixels
+
+
+def main():
+    # Initialize Pygame
+    pygame.init()
+    screen = pygame.display.set_mode((width, height))
+    pygame.display.set_caption("Simple Pygame Game")
+
+    entities = Entities(int(sys.argv[1]) if len(sys.argv) > 1 else ENTITY_COUNT, screen)
+    player_x = width // 2 - player_size // 2
+    player_y = height - 2 * player_size
+
+    # Game loop
+    clock = pygame.time.Clock()
+    frames = 0
+    running = True
+
+    while running:
+        # Event handling
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+
+        # Get keyboard input
+        keys = pygame.key.get_pressed()
+        if keys[pygame.K_LEFT] and player_x > 0:
+            player_x -= player_speed
+        if keys[pygame.K_RIGHT] and player_x < width - player_size:
+            player_x += player_speed
+        if keys[pygame.K_UP] and player_y > 0:
+            player_y -= player_speed
+        if keys[pygame.K_DOWN] and player_y < height - player_size:
+            player_y += player_speed
+        player_rect = pygame.Rect(player_x, player_y, player_size, player_size)
+
+        # Move the entities by the real frame time, so they keep their speed if frames drop
+        entities.update(min(clock.get_time() / 1000, 0.05), player_rect)
+
+        # Clear the screen
+        screen.fill(BLACK)
+
+        # Draw the entities, then the player over them
+        entities.draw(screen)
+        pygame.draw.rect(screen, BLUE, player_rect)
+
+        # Update the display
+        pygame.display.flip()
+
+        # Cap the frame rate, showing the achieved rate in the title once a second
+        clock.tick(60)
+        frames += 1
+        if frames % 60 == 0:
+            pygame.display.set_caption(f"Simple Pygame Game - {entities.count} entities, {clock.get_fps():.0f} fps")
+
+    # Quit Pygame
+    pygame.quit()
+    sys.exit()
+
+
+if __name__ == '__main__':
+    main()
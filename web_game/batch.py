@@ -0,0 +1,251 @@
+# Lockstep simulator for many games at once, for training and evaluating bots.
+# Boards are held as packed row bitmasks in a (N, GRID_HEIGHT) array and every
+# rule (collision, locking, line clears, scoring) is applied to all boards with
+# vectorised NumPy operations. Given the same seeds and actions it matches
+# game.step() exactly.
+import random
+
+import numpy as np
+
+from engine import GRID_WIDTH, GRID_HEIGHT, FULL_ROW, PIECES
+from game import MOVE_LEFT, MOVE_RIGHT, SOFT_DROP, ROTATE, HARD_DROP, PAUSE, RESTART, LINE_SCORES
+
+# Piece tables indexed by [shape_index, rotation]; rotations past a shape's
+# count are never used. Row masks are aligned to the piece's leftmost column.
+MAX_ROTATIONS = max(len(rotations) for rotations in PIECES)
+ROTATION_COUNTS = np.array([len(rotations) for rotations in PIECES], dtype=np.int64)
+PIECE_MASKS = np.zeros((len(PIECES), MAX_ROTATIONS, 5), dtype=np.int64)
+PIECE_LEFT = np.zeros((len(PIECES), MAX_ROTATIONS), dtype=np.int64)
+PIECE_RIGHT = np.zeros((len(PIECES), MAX_ROTATIONS), dtype=np.int64)
+PIECE_BOTTOM = np.zeros((len(PIECES), MAX_ROTATIONS), dtype=np.int64)
+for shape_index, rotations in enumerate(PIECES):
+    for rotation, piece in enumerate(rotations):
+        for dy, mask in piece.rows:
+            PIECE_MASKS[shape_index, rotation, dy] = mask
+        PIECE_LEFT[shape_index, rotation] = piece.left
+        PIECE_RIGHT[shape_index, rotation] = piece.right
+        PIECE_BOTTOM[shape_index, rotation] = piece.bottom
+
+# Score for clearing 0-4 lines, before the level multiplier
+CLEAR_SCORES = np.array([0] + LINE_SCORES, dtype=np.int64)
+
+SPAWN_X = GRID_WIDTH // 2 - 2
+
+
+class BatchGame:
+    # N independent games. Each board draws its pieces from its own
+    # random.Random(seed), the same way GameState does, so a board here and a
+    # GameState with the same seed see the same pieces.
+    def __init__(self, seeds):
+        self.rngs = [random.Random(seed) for seed in seeds]
+        n = len(self.rngs)
+        self.count = n
+        self.index = np.arange(n)
+        self.rows = np.zeros((n, GRID_HEIGHT), dtype=np.int64)
+        self.shape = np.zeros(n, dtype=np.int64)
+        self.next_shape = np.zeros(n, dtype=np.int64)
+        self.rotation = np.zeros(n, dtype=np.int64)
+        self.x = np.zeros(n, dtype=np.int64)
+        self.y = np.zeros(n, dtype=np.int64)
+        self.score = np.zeros(n, dtype=np.int64)
+        self.level = np.ones(n, dtype=np.int64)
+        self.lines_cleared = np.zeros(n, dtype=np.int64)
+        self.pieces_placed = np.zeros(n, dtype=np.int64)
+        self.fall_time = np.zeros(n, dtype=np.float64)
+        self.game_over = np.zeros(n, dtype=bool)
+        self.paused = np.zeros(n, dtype=bool)
+        self.reset(np.ones(n, dtype=bool))
+
+    def reset(self, which):
+        # Start new games on the boards selected by the boolean mask
+        self.rows[which] = 0
+        self.score[which] = 0
+        self.level[which] = 1
+        self.lines_cleared[which] = 0
+        self.pieces_placed[which] = 0
+        self.fall_time[which] = 0
+        self.game_over[which] = False
+        for i in np.flatnonzero(which):
+            self.shape[i] = self.rngs[i].randint(0, len(PIECES) - 1)
+            self.next_shape[i] = self.rngs[i].randint(0, len(PIECES) - 1)
+        self.rotation[which] = 0
+        self.x[which] = SPAWN_X
+        self.y[which] = 0
+
+    def grow(self, count):
+        # Add boards up to count, keeping the existing games. New boards start
+        # games from unseeded generators; use start() to seed them.
+        old = self.count
+        for name in ('rows', 'shape', 'next_shape', 'rotation', 'x', 'y', 'score', 'level',
+                     'lines_cleared', 'pieces_placed', 'fall_time', 'game_over', 'paused'):
+            array = getattr(self, name)
+            grown = np.zeros((count,) + array.shape[1:], dtype=array.dtype)
+            grown[:old] = array
+            setattr(self, name, grown)
+        self.rngs += [random.Random() for _ in range(count - old)]
+        self.count = count
+        self.index = np.arange(count)
+        added = np.zeros(count, dtype=bool)
+        added[old:] = True
+        self.reset(added)
+
+    def start(self, i, seed):
+        # Begin a fresh, unpaused game on board i with its own seed
+        self.rngs[i] = random.Random(seed)
+        self.paused[i] = False
+        which = np.zeros(self.count, dtype=bool)
+        which[i] = True
+        self.reset(which)
+
+    def collides(self, which, rotation, x, y):
+        # Collision test for the selected boards' current shapes at the given
+        # rotation and position (arrays aligned with the selected boards)
+        index = self.index[which]
+        shape = self.shape[which]
+        left = PIECE_LEFT[shape, rotation]
+        hit = (x + left < 0) | (x + PIECE_RIGHT[shape, rotation] >= GRID_WIDTH) | (y + PIECE_BOTTOM[shape, rotation] >= GRID_HEIGHT)
+        # minimum/maximum rather than np.clip, which costs more than the test itself on small arrays
+        shift = np.minimum(np.maximum(x + left, 0), GRID_WIDTH - 1)
+        for dy in range(5):
+            mask = PIECE_MASKS[shape, rotation, dy] << shift
+            row_y = y + dy
+            row = self.rows[index, np.minimum(np.maximum(row_y, 0), GRID_HEIGHT - 1)]
+            hit |= (row_y >= 0) & (row_y < GRID_HEIGHT) & (row & mask != 0)
+        return hit
+
+    def try_move(self, which, dx, dy):
+        # Move the selected pieces where the target is free; returns which moved
+        rotation = self.rotation[which]
+        x = self.x[which] + dx
+        y = self.y[which] + dy
+        moved = ~self.collides(which, rotation, x, y)
+        selected = np.flatnonzero(which)[moved]
+        self.x[selected] = x[moved]
+        self.y[selected] = y[moved]
+        result = np.zeros(self.count, dtype=bool)
+        result[selected] = True
+        return result
+
+    def rotate(self, which):
+        shape = self.shape[which]
+        rotation = (self.rotation[which] + 1) % ROTATION_COUNTS[shape]
+        fits = ~self.collides(which, rotation, self.x[which], self.y[which])
+        selected = np.flatnonzero(which)[fits]
+        self.rotation[selected] = rotation[fits]
+
+    def hard_drop(self, which):
+        # Let every selected piece fall until it rests. Every drop distance is
+        # tested at once, as a (boards, GRID_HEIGHT) grid, and each piece stops
+        # just above its first collision.
+        index = self.index[which]
+        shape = self.shape[which]
+        rotation = self.rotation[which]
+        y = self.y[which]
+        shift = (self.x[which] + PIECE_LEFT[shape, rotation])[:, None]
+        drop_y = y[:, None] + np.arange(1, GRID_HEIGHT + 1)
+        hit = drop_y + PIECE_BOTTOM[shape, rotation][:, None] >= GRID_HEIGHT
+        for dy in range(5):
+            mask = PIECE_MASKS[shape, rotation, dy][:, None] << shift
+            row_y = drop_y + dy
+            row = self.rows[index[:, None], np.minimum(np.maximum(row_y, 0), GRID_HEIGHT - 1)]
+            hit |= (row_y >= 0) & (row_y < GRID_HEIGHT) & (row & mask != 0)
+        self.y[index] = y + hit.argmax(axis=1)
+
+    def lock_and_spawn(self, which):
+        # Lock the selected pieces, clear full rows, score them and spawn the next piece
+        if not which.any():
+            return
+        index = self.index[which]
+        shape = self.shape[which]
+        rotation = self.rotation[which]
+        y = self.y[which]
+        shift = self.x[which] + PIECE_LEFT[shape, rotation]
+        for dy in range(5):
+            mask = PIECE_MASKS[shape, rotation, dy] << shift
+            row_y = y + dy
+            visible = (row_y >= 0) & (mask != 0)  # Only add to grid if it's visible
+            self.rows[index[visible], row_y[visible]] |= mask[visible]
+        self.pieces_placed[which] += 1
+        self.clear_lines(which)
+
+        for i in index:
+            self.shape[i] = self.next_shape[i]
+            self.next_shape[i] = self.rngs[i].randint(0, len(PIECES) - 1)
+        self.rotation[which] = 0
+        self.x[which] = SPAWN_X
+        self.y[which] = 0
+        blocked = self.collides(which, self.rotation[which], self.x[which], self.y[which])
+        self.game_over[index[blocked]] = True
+
+    def clear_lines(self, which):
+        full = (self.rows == FULL_ROW) & which[:, None]
+        counts = full.sum(axis=1)
+        clearing = counts > 0
+        if not clearing.any():
+            return counts
+
+        # Update score
+        self.score += CLEAR_SCORES[np.minimum(counts, 4)] * self.level
+        self.lines_cleared += counts
+        self.level = self.lines_cleared // 10 + 1
+
+        # Compact the surviving rows towards the bottom: each kept row moves down
+        # by the number of full rows beneath it, and the top is refilled with zeros
+        rows = self.rows[clearing]
+        keep = ~full[clearing]
+        below = np.cumsum(full[clearing][:, ::-1], axis=1)[:, ::-1] - full[clearing]
+        board, row_y = np.nonzero(keep)
+        compacted = np.zeros_like(rows)
+        compacted[board, row_y + below[board, row_y]] = rows[board, row_y]
+        self.rows[clearing] = compacted
+        return counts
+
+    def step(self, actions, dt):
+        # Advance every board by one step: apply its input actions (the same
+        # bit flags as game.step) and then dt seconds of gravity
+        actions = np.asarray(actions, dtype=np.int64)
+        self.paused ^= (actions & PAUSE) != 0
+        restart = ((actions & RESTART) != 0) & self.game_over
+        if restart.any():
+            self.reset(restart)
+        active = ~(self.game_over | self.paused)
+
+        which = active & ((actions & MOVE_LEFT) != 0)
+        if which.any():
+            self.try_move(which, -1, 0)
+        which = active & ((actions & MOVE_RIGHT) != 0)
+        if which.any():
+            self.try_move(which, 1, 0)
+        which = active & ((actions & ROTATE) != 0)
+        if which.any():
+            self.rotate(which)
+        which = active & ((actions & SOFT_DROP) != 0)
+        if which.any():
+            self.fall_time[self.try_move(which, 0, 1)] = 0
+
+        dropping = active & ((actions & HARD_DROP) != 0)
+        if dropping.any():
+            self.hard_drop(dropping)
+            self.fall_time[dropping] = 0
+            self.lock_and_spawn(dropping)
+
+        # Gravity for everything that didn't hard drop this step
+        falling = active & ~dropping
+        self.fall_time[falling] += dt
+        due = falling & (self.fall_time >= np.maximum(0.05, 0.5 - (self.level - 1) * 0.05))
+        self.fall_time[due] = 0
+        if due.any():
+            landed = due & ~self.try_move(due, 0, 1)
+            self.lock_and_spawn(landed)
+
+    def place(self, rotations, columns):
+        # Bot-style move: turn each active piece to the given rotation, shift it
+        # to the given column and hard drop it. Boards where the target doesn't
+        # fit at the spawn row keep their piece where it is before dropping.
+        active = ~(self.game_over | self.paused)
+        rotations = np.asarray(rotations, dtype=np.int64) % ROTATION_COUNTS[self.shape]
+        columns = np.asarray(columns, dtype=np.int64)
+        fits = active & ~self.collides(np.ones(self.count, dtype=bool), rotations, columns, self.y)
+        self.rotation[fits] = rotations[fits]
+        self.x[fits] = columns[fits]
+        self.step(np.where(active, HARD_DROP, 0), 0)
@@ -0,0 +1,205 @@
+# Placement-search AI. It finds every placement the current piece can reach,
+# scores the resulting boards with a weighted heuristic, looks one piece ahead
+# using the next piece, and remembers scored boards in a bounded table.
+# Used for autoplay and the on-screen hint, and by the headless tools.
+from collections import OrderedDict, deque
+
+from engine import GRID_WIDTH, GRID_HEIGHT, FULL_ROW, PIECES, Board
+from game import MOVE_LEFT, MOVE_RIGHT, ROTATE, SOFT_DROP, HARD_DROP
+
+# Heuristic weights for aggregate height, lines cleared, holes and bumpiness
+DEFAULT_WEIGHTS = {'height': -0.510066, 'lines': 0.760666, 'holes': -0.35663, 'bumpiness': -0.184483}
+
+
+def column_heights(rows):
+    heights = [0] * GRID_WIDTH
+    seen = 0
+    for y, row in enumerate(rows):
+        new = row & ~seen
+        if new:
+            seen |= new
+            x = 0
+            while new:
+                if new & 1:
+                    heights[x] = GRID_HEIGHT - y
+                new >>= 1
+                x += 1
+            if seen == FULL_ROW:
+                break
+    return heights
+
+
+def board_from_rows(rows):
+    # A Board with just enough filled in for collides() and drop_distance()
+    board = Board.__new__(Board)
+    board.rows = list(rows)
+    board.heights = column_heights(rows)
+    board.cells = None
+    board.dirty = 0
+    return board
+
+
+def place(rows, piece, x, y):
+    # Rows after locking piece at (x, y) and clearing lines, plus the number cleared
+    new_rows = list(rows)
+    shift = x + piece.left
+    for dy, mask in piece.rows:
+        if y + dy >= 0:
+            new_rows[y + dy] |= mask << shift
+    kept = [row for row in new_rows if row != FULL_ROW]
+    cleared = GRID_HEIGHT - len(kept)
+    if cleared:
+        kept[:0] = [0] * cleared
+    return tuple(kept), cleared
+
+
+class Bot:
+    def __init__(self, weights=None, lookahead=True, beam=6, table_size=100000):
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.lookahead = lookahead
+        # Only the best few placements of the current piece are searched a piece deeper
+        self.beam = beam
+        # Transposition table of scored boards, least recently used evicted first
+        self.table = OrderedDict()
+        self.table_size = table_size
+
+    def remember(self, key, value):
+        self.table[key] = value
+        if len(self.table) > self.table_size:
+            self.table.popitem(last=False)
+        return value
+
+    def evaluate(self, rows):
+        # Heuristic score of a board, excluding lines cleared to reach it
+        value = self.table.get(rows)
+        if value is not None:
+            self.table.move_to_end(rows)
+            return value
+
+        heights = [0] * GRID_WIDTH
+        seen = 0
+        holes = 0
+        for y, row in enumerate(rows):
+            # Empty cells under a filled cell in the same column are holes
+            holes += (seen & ~row).bit_count()
+            new = row & ~seen
+            if new:
+                seen |= new
+                x = 0
+                while new:
+                    if new & 1:
+                        heights[x] = GRID_HEIGHT - y
+                    new >>= 1
+                    x += 1
+        bumpiness = 0
+        for x in range(GRID_WIDTH - 1):
+            bumpiness += abs(heights[x] - heights[x + 1])
+
+        weights = self.weights
+        value = weights['height'] * sum(heights) + weights['holes'] * holes + weights['bumpiness'] * bumpiness
+        return self.remember(rows, value)
+
+    def placements(self, board, shape_index, rotation, x, y):
+        # Breadth-first search over (rotation, x, y) from the given position.
+        # Moves are left, right, rotate and a soft drop straight to rest, so pieces
+        # can slide and turn under overhangs. Returns {(rotation, x, y): actions}
+        # for every resting position, each with the shortest action list to it.
+        rotations = PIECES[shape_index]
+        start = (rotation, x, y)
+        parents = {start: None}
+        queue = deque([start])
+        finals = []
+        while queue:
+            position = queue.popleft()
+            rotation, x, y = position
+            piece = rotations[rotation]
+
+            distance = board.drop_distance(piece, x, y)
+            if distance:
+                moves = [((rotation, x, y + distance), SOFT_DROP, distance)]
+            else:
+                finals.append(position)
+                moves = []
+            if not board.collides(piece, x - 1, y):
+                moves.append(((rotation, x - 1, y), MOVE_LEFT, 1))
+            if not board.collides(piece, x + 1, y):
+                moves.append(((rotation, x + 1, y), MOVE_RIGHT, 1))
+            turned = (rotation + 1) % len(rotations)
+            if turned != rotation and not board.collides(rotations[turned], x, y):
+                moves.append(((turned, x, y), ROTATE, 1))
+
+            for target, action, count in moves:
+                if target not in parents:
+                    parents[target] = (position, action, count)
+                    queue.append(target)
+
+        result = {}
+        for position in finals:
+            actions = []
+            step = parents[position]
+            while step is not None:
+                previous, action, count = step
+                actions.extend([action] * count)
+                step = parents[previous]
+            actions.reverse()
+            result[position] = actions
+        return result
+
+    def best_drop(self, rows, shape_index):
+        # Best score for the next piece using plain drops from the top, with the
+        # value kept in the transposition table for the (board, piece) pair
+        key = (rows, shape_index)
+        value = self.table.get(key)
+        if value is not None:
+            self.table.move_to_end(key)
+            return value
+
+        board = board_from_rows(rows)
+        lines_weight = self.weights['lines']
+        best = None
+        for piece in PIECES[shape_index]:
+            for x in range(-piece.left, GRID_WIDTH - piece.right):
+                if board.collides(piece, x, 0):
+                    continue
+                new_rows, lines = place(rows, piece, x, board.drop_distance(piece, x, 0))
+                score = lines_weight * lines + self.evaluate(new_rows)
+                if best is None or score > best:
+                    best = score
+        if best is None:
+            # Nowhere to put the next piece: the game would end
+            best = float('-inf')
+        return self.remember(key, best)
+
+    def choose(self, state):
+        # Best reachable placement for the current piece as (rotation, x, y, actions),
+        # or None if the game can't continue
+        piece = state.current
+        board = state.board
+        finals = self.placements(board, piece.shape_index, piece.rotation, piece.x, piece.y)
+        if not finals:
+            return None
+
+        lines_weight = self.weights['lines']
+        rows = tuple(board.rows)
+        rotations = PIECES[piece.shape_index]
+        scored = []
+        for (rotation, x, y), actions in finals.items():
+            new_rows, lines = place(rows, rotations[rotation], x, y)
+            scored.append((lines_weight * lines + self.evaluate(new_rows), new_rows, lines, (rotation, x, y, actions)))
+
+        if self.lookahead:
+            scored.sort(key=lambda entry: entry[0], reverse=True)
+            best = None
+            for _, new_rows, lines, placement in scored[:self.beam]:
+                score = lines_weight * lines + self.best_drop(new_rows, state.next.shape_index)
+                if best is None or score > best[0]:
+                    best = (score, placement)
+            return best[1]
+        return max(scored, key=lambda entry: entry[0])[3]
+
+    def plan(self, state):
+        # Actions that take the current piece to the chosen placement and lock it
+        choice = self.choose(state)
+        if choice is None:
+            return [HARD_DROP]
+        return choice[3] + [HARD_DROP]
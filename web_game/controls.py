@@ -0,0 +1,83 @@
+# Input helpers for the on-screen controls: an O(1) hit test over the button
+# layout and delayed auto-shift / auto-repeat timed in milliseconds.
+
+# Delayed auto-shift and auto-repeat rate, in milliseconds
+DAS_MS = 170
+ARR_MS = 50
+
+# Most repeats applied in one go after a stall
+MAX_REPEAT_BURST = 10
+
+NO_MOVES = ()
+
+
+class HitMap:
+    # Precomputed lookup from a logical screen position to the button under it.
+    # The screen is split into cell x cell squares, each holding the button its
+    # centre falls in, so a hit test is one index instead of a walk over buttons.
+    def __init__(self, buttons, size, cell=5):
+        self.cell = cell
+        self.columns = size[0] // cell + 1
+        self.rows = size[1] // cell + 1
+        self.cells = [None] * (self.columns * self.rows)
+        for button_name, button_data in buttons.items():
+            rect = button_data['rect']
+            for row in range(max(0, rect.top // cell), min(self.rows, rect.bottom // cell + 1)):
+                for column in range(max(0, rect.left // cell), min(self.columns, rect.right // cell + 1)):
+                    if rect.collidepoint(column * cell + cell // 2, row * cell + cell // 2):
+                        self.cells[row * self.columns + column] = button_name
+
+    def button_at(self, pos):
+        column = pos[0] // self.cell
+        row = pos[1] // self.cell
+        if 0 <= column < self.columns and 0 <= row < self.rows:
+            return self.cells[row * self.columns + column]
+        return None
+
+
+class AutoRepeat:
+    # Delayed auto-shift / auto-repeat for held directions. A direction can be
+    # held by several sources at once (a key and a finger); it repeats until the
+    # last one lets go. Timing comes from input timestamps, not frame counts.
+    def __init__(self, delay=DAS_MS, interval=ARR_MS):
+        self.delay = delay
+        self.interval = interval
+        self.held = {}  # direction -> [pressed_at, repeats_done, holders]
+
+    def press(self, direction, now):
+        # Returns True when this starts a new hold, i.e. the caller should move once now
+        state = self.held.get(direction)
+        if state is not None:
+            state[2] += 1
+            return False
+        self.held[direction] = [now, 0, 1]
+        return True
+
+    def release(self, direction):
+        state = self.held.get(direction)
+        if state is not None:
+            state[2] -= 1
+            if state[2] <= 0:
+                del self.held[direction]
+
+    def clear(self):
+        self.held.clear()
+
+    def due(self, now):
+        # Directions to move again, one entry per repeat that has come due.
+        # Called every frame, so nothing is allocated until a repeat is due.
+        moves = NO_MOVES
+        for direction in self.held:
+            state = self.held[direction]
+            elapsed = now - state[0]
+            if elapsed < self.delay:
+                continue
+            total = 1 + (elapsed - self.delay) // self.interval
+            count = min(total - state[1], MAX_REPEAT_BURST)
+            if count <= 0:
+                continue
+            state[1] = total
+            if moves is NO_MOVES:
+                moves = []
+            moves.extend([direction] * count)
+        return moves
@@ -0,0 +1,290 @@
+# Board effects: cleared rows flash and the rows above collapse into the gap,
+# hard drops leave a fading trail and throw up dust, and line clears burst
+# into particles. Everything is allocated up front, so starting and running
+# effects creates no objects: particles live in fixed-capacity parallel lists,
+# drawing areas are Rects updated in place, and the flash and trail are two
+# reused surfaces whose alpha is set per draw. Effects advance by the frame's
+# dt, and when they take more than their share of a frame the particle limit
+# is cut back, so busy moments get fewer particles rather than late frames.
+import random
+import time
+
+import pygame
+
+# Seconds for each stage of a line clear: the rows flash, then the rows above collapse
+FLASH_TIME = 0.08
+COLLAPSE_TIME = 0.12
+TRAIL_TIME = 0.18
+PARTICLE_TIME = 0.6
+
+MAX_CLEARED = 4
+TRAIL_CAPACITY = 8
+# A trail covers at most this many rows above where the piece landed, and the
+# middle of the column; alpha blits cost by area
+TRAIL_ROWS = 5
+PARTICLE_CAPACITY = 512
+PARTICLES_PER_ROW = 24
+DUST_PER_COLUMN = 3
+PARTICLE_SIZE = 3
+GRAVITY = 900  # pixels per second squared
+
+# Fading steps for particle colours
+SHADES = 8
+
+# Seconds per frame the effects may take, and the fewest particles they're cut back to
+BUDGET = 0.002
+MIN_PARTICLES = 32
+
+
+class Effects:
+    def __init__(self, renderer, colors, flash_color=(255, 255, 255)):
+        self.pitch = renderer.pitch
+        self.margin = renderer.margin
+        self.cell_size = renderer.cell_size
+        self.width, self.height = renderer.surface.get_size()
+        # Separate from the game's generator, so effects never change the pieces
+        self.rng = random.Random()
+        self.active = False
+
+        # Particle colours by colour index (the flash colour last) and fade step
+        palette = list(colors) + [flash_color]
+        self.flash_index = len(colors)
+        self.shades = [[tuple(c * (step + 1) // SHADES for c in color) for step in range(SHADES)]
+                       for color in palette]
+
+        # Line clear: the cleared rows, top to bottom
+        self.cleared = [0] * MAX_CLEARED
+        self.cleared_count = 0
+        self.clear_age = 0.0
+        self.flash = pygame.Surface((self.width, self.pitch))
+        self.flash.fill(flash_color)
+
+        # Hard-drop trails, one column each
+        self.trail_width = max(2, self.cell_size // 2)
+        self.trail = pygame.Surface((self.trail_width, TRAIL_ROWS * self.pitch))
+        self.trail.fill(flash_color)
+        self.trail_x = [0] * TRAIL_CAPACITY
+        self.trail_y = [0] * TRAIL_CAPACITY
+        self.trail_height = [0] * TRAIL_CAPACITY
+        self.trail_age = [TRAIL_TIME] * TRAIL_CAPACITY
+        self.next_trail = 0
+        self.column_top = [0] * 5
+
+        # Live particles are the first `particles` entries of each list
+        self.x = [0.0] * PARTICLE_CAPACITY
+        self.y = [0.0] * PARTICLE_CAPACITY
+        self.vx = [0.0] * PARTICLE_CAPACITY
+        self.vy = [0.0] * PARTICLE_CAPACITY
+        self.age = [0.0] * PARTICLE_CAPACITY
+        self.color = [0] * PARTICLE_CAPACITY
+        self.particles = 0
+        self.limit = PARTICLE_CAPACITY
+
+        # Seconds spent on effects since the last update
+        self.cost = 0.0
+
+        # Board area the effects cover this frame, set by update()
+        self.bounds = pygame.Rect(0, 0, 0, 0)
+
+        self.area = pygame.Rect(0, 0, 0, 0)
+        self.dest = pygame.Rect(0, 0, 0, 0)
+        self.particle = pygame.Rect(0, 0, PARTICLE_SIZE, PARTICLE_SIZE)
+
+    def reset(self):
+        self.cleared_count = 0
+        self.particles = 0
+        for i in range(TRAIL_CAPACITY):
+            self.trail_age[i] = TRAIL_TIME
+        self.active = False
+
+    def spawn(self, x, y, vx, vy, color):
+        if self.particles >= self.limit:
+            return
+        i = self.particles
+        self.x[i] = x
+        self.y[i] = y
+        self.vx[i] = vx
+        self.vy[i] = vy
+        self.age[i] = 0.0
+        self.color[i] = color
+        self.particles = i + 1
+
+    def line_clear(self, rows):
+        # rows are the cleared row indices, top to bottom, as check_lines() returns them
+        count = min(len(rows), MAX_CLEARED)
+        for i in range(count):
+            self.cleared[i] = rows[i]
+        self.cleared_count = count
+        self.clear_age = 0.0
+        rng = self.rng
+        for i in range(count):
+            y = self.margin + rows[i] * self.pitch + self.pitch / 2
+            for _ in range(PARTICLES_PER_ROW):
+                color = self.flash_index if rng.random() < 0.5 else rng.randrange(self.flash_index)
+                self.spawn(rng.random() * self.width, y, rng.uniform(-160, 160), rng.uniform(-320, -40), color)
+        self.active = True
+
+    def hard_drop(self, shape, x, y, distance, color):
+        # A piece with the given shape fell `distance` rows from (x, y): a trail
+        # over each column it passed through, and dust where it landed
+        if distance <= 0:
+            return
+        top = self.column_top
+        for dx in range(5):
+            top[dx] = -1
+        for dx, dy in shape.cells:
+            if top[dx] < 0 or dy < top[dx]:
+                top[dx] = dy
+        rng = self.rng
+        pitch = self.pitch
+        for dx in range(5):
+            if top[dx] < 0:
+                continue
+            i = self.next_trail
+            self.next_trail = (i + 1) % TRAIL_CAPACITY
+            column = self.margin + (x + dx) * pitch
+            landed = self.margin + (y + distance + top[dx]) * pitch
+            self.trail_x[i] = column + (self.cell_size - self.trail_width) // 2
+            self.trail_height[i] = min(distance, TRAIL_ROWS) * pitch
+            self.trail_y[i] = landed - self.trail_height[i]
+            self.trail_age[i] = 0.0
+            for _ in range(DUST_PER_COLUMN):
+                self.spawn(column + rng.random() * self.cell_size, landed,
+                           rng.uniform(-60, 60), rng.uniform(-160, -60), color)
+        self.active = True
+
+    def update(self, dt):
+        start = time.perf_counter()
+        # Adjust the particle limit to what the last frame's effects cost
+        if self.cost > BUDGET:
+            self.limit = max(MIN_PARTICLES, self.limit * 3 // 4)
+        elif self.cost < BUDGET / 2 and self.limit < PARTICLE_CAPACITY:
+            self.limit = min(PARTICLE_CAPACITY, self.limit + 16)
+        if self.particles > self.limit:
+            self.particles = self.limit
+
+        # The box around everything still to draw, in board coordinates
+        width = self.width
+        height = self.height
+        left = width
+        top = height
+        right = 0
+        bottom = 0
+
+        if self.cleared_count:
+            self.clear_age += dt
+            if self.clear_age >= FLASH_TIME + COLLAPSE_TIME:
+                self.cleared_count = 0
+            else:
+                left = top = 0
+                right = width
+                bottom = self.margin + (self.cleared[self.cleared_count - 1] + 1) * self.pitch
+        trails = False
+        trail_age = self.trail_age
+        for i in range(TRAIL_CAPACITY):
+            if trail_age[i] < TRAIL_TIME:
+                trail_age[i] += dt
+                trails = True
+                left = min(left, self.trail_x[i])
+                top = min(top, self.trail_y[i])
+                right = max(right, self.trail_x[i] + self.trail_width)
+                bottom = max(bottom, self.trail_y[i] + self.trail_height[i])
+
+        # Dead particles are replaced by the last live one, keeping the live ones first
+        x = self.x
+        y = self.y
+        vx = self.vx
+        vy = self.vy
+        age = self.age
+        color = self.color
+        count = self.particles
+        i = 0
+        while i < count:
+            age[i] += dt
+            vy[i] += GRAVITY * dt
+            x[i] += vx[i] * dt
+            y[i] += vy[i] * dt
+            if age[i] >= PARTICLE_TIME or not 0 <= x[i] < width or y[i] >= height:
+                count -= 1
+                x[i] = x[count]
+                y[i] = y[count]
+                vx[i] = vx[count]
+                vy[i] = vy[count]
+                age[i] = age[count]
+                color[i] = color[count]
+                continue
+            if x[i] < left:
+                left = x[i]
+            if x[i] > right:
+                right = x[i]
+            if y[i] < top:
+                top = y[i]
+            if y[i] > bottom:
+                bottom = y[i]
+            i += 1
+        self.particles = count
+
+        self.active = bool(self.cleared_count or trails or count)
+        if self.active:
+            top = max(0, int(top))
+            self.bounds.update(int(left), top, int(right) + PARTICLE_SIZE + 1 - int(left), int(bottom) + PARTICLE_SIZE + 1 - top)
+        else:
+            self.bounds.update(0, 0, 0, 0)
+        self.cost = time.perf_counter() - start
+
+    def draw_board(self, surface, board, left, top):
+        # The board, with the rows above a fresh clear still sliding into place
+        surface.blit(board, (left, top))
+        if not self.cleared_count:
+            return
+        start = time.perf_counter()
+        pitch = self.pitch
+        margin = self.margin
+        count = self.cleared_count
+        cleared = self.cleared
+        t = max(0.0, self.clear_age - FLASH_TIME) / COLLAPSE_TIME
+        gap = int(pitch * (1 - t))
+        self.flash.set_alpha(int(255 * (1 - t)))
+
+        # Band k holds what was between cleared rows k - 1 and k (the fresh rows
+        # on top for the first band); it has fallen count - k rows, and is drawn
+        # that far up less the progress of the collapse, with the cleared row's
+        # shrinking flash under it
+        band_top = 0
+        for k in range(count):
+            band_bottom = margin + (cleared[k] + count - k) * pitch
+            lift = (count - k) * pitch - int((count - k) * pitch * t)
+            if band_bottom > band_top:
+                self.area.update(0, band_top, self.width, band_bottom - band_top)
+                self.dest.update(left, top + band_top - lift, 0, 0)
+                surface.blit(board, self.dest, self.area)
+            if gap > 0:
+                self.area.update(0, 0, self.width, gap)
+                self.dest.update(left, top + band_bottom - lift, 0, 0)
+                surface.blit(self.flash, self.dest, self.area)
+            band_top = band_bottom
+        self.cost += time.perf_counter() - start
+
+    def draw(self, surface, left, top):
+        # Trails and particles over the board at (left, top)
+        start = time.perf_counter()
+        trail_age = self.trail_age
+        for i in range(TRAIL_CAPACITY):
+            if trail_age[i] < TRAIL_TIME:
+                self.trail.set_alpha(int(140 * (1 - trail_age[i] / TRAIL_TIME)))
+                self.area.update(0, 0, self.trail_width, self.trail_height[i])
+                self.dest.update(left + self.trail_x[i], top + self.trail_y[i], 0, 0)
+                surface.blit(self.trail, self.dest, self.area)
+
+        particle = self.particle
+        shades = self.shades
+        x = self.x
+        y = self.y
+        age = self.age
+        color = self.color
+        for i in range(self.particles):
+            particle.x = left + int(x[i])
+            particle.y = top + int(y[i])
+            surface.fill(shades[color[i]][int((1 - age[i] / PARTICLE_TIME) * (SHADES - 1))], particle)
+        self.cost += time.perf_counter() - start
+
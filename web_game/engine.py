@@ -0,0 +1,264 @@
+# Headless Tetris core: bitboard rows and precompiled piece rotations.
+# Nothing in here imports pygame, so bots and replay validators can use it directly.
+
+# Game settings
+GRID_WIDTH = 10
+GRID_HEIGHT = 20
+
+# A row with every column filled
+FULL_ROW = (1 << GRID_WIDTH) - 1
+
+# Bit y set for every row of the board
+ALL_ROWS = (1 << GRID_HEIGHT) - 1
+
+# Tetromino shapes
+SHAPES = [
+    # I piece
+    [
+        ['.....',
+         '.....',
+         'IIII.',
+         '.....',
+         '.....'],
+        ['..I..',
+         '..I..',
+         '..I..',
+         '..I..',
+         '.....']
+    ],
+    # J piece
+    [
+        ['.....',
+         '.J...',
+         '.JJJ.',
+         '.....',
+         '.....'],
+        ['.....',
+         '..JJ.',
+         '..J..',
+         '..J..',
+         '.....'],
+        ['.....',
+         '.....',
+         '.JJJ.',
+         '...J.',
+         '.....'],
+        ['.....',
+         '..J..',
+         '..J..',
+         '.JJ..',
+         '.....']
+    ],
+    # L piece
+    [
+        ['.....',
+         '...L.',
+         '.LLL.',
+         '.....',
+         '.....'],
+        ['.....',
+         '..L..',
+         '..L..',
+         '..LL.',
+         '.....'],
+        ['.....',
+         '.....',
+         '.LLL.',
+         '.L...',
+         '.....'],
+        ['.....',
+         '.LL..',
+         '..L..',
+         '..L..',
+         '.....']
+    ],
+    # O piece
+    [
+        ['.....',
+         '.....',
+         '.OO..',
+         '.OO..',
+         '.....']
+    ],
+    # S piece
+    [
+        ['.....',
+         '.....',
+         '..SS.',
+         '.SS..',
+         '.....'],
+        ['.....',
+         '..S..',
+         '..SS.',
+         '...S.',
+         '.....']
+    ],
+    # T piece
+    [
+        ['.....',
+         '..T..',
+         '.TTT.',
+         '.....',
+         '.....'],
+        ['.....',
+         '..T..',
+         '..TT.',
+         '..T..',
+         '.....'],
+        ['.....',
+         '.....',
+         '.TTT.',
+         '..T..',
+         '.....'],
+        ['.....',
+         '..T..',
+         '.TT..',
+         '..T..',
+         '.....']
+    ],
+    # Z piece
+    [
+        ['.....',
+         '.....',
+         '.ZZ..',
+         '..ZZ.',
+         '.....'],
+        ['.....',
+         '...Z.',
+         '..ZZ.',
+         '..Z..',
+         '.....']
+    ]
+]
+
+
+class PieceShape:
+    # One rotation of one tetromino, compiled from its 5x5 string form.
+    # Offsets are relative to the piece's (x, y) anchor, i.e. the top-left of the 5x5 box.
+    __slots__ = ('cells', 'rows', 'bottoms', 'left', 'right', 'top', 'bottom')
+
+    def __init__(self, pattern):
+        self.cells = tuple((x, y) for y, row in enumerate(pattern)
+                           for x, cell in enumerate(row) if cell != '.')
+        xs = [x for x, _ in self.cells]
+        ys = [y for _, y in self.cells]
+        self.left = min(xs)
+        self.right = max(xs)
+        self.top = min(ys)
+        self.bottom = max(ys)
+
+        # Row masks are shifted so bit 0 is the leftmost column of the piece,
+        # which lets collision shift them by (x + left) without going negative
+        masks = {}
+        for x, y in self.cells:
+            masks[y] = masks.get(y, 0) | (1 << (x - self.left))
+        self.rows = tuple(sorted(masks.items()))
+
+        # Lowest cell in each column the piece covers, used against the skyline
+        lowest = {}
+        for x, y in self.cells:
+            lowest[x] = max(lowest.get(x, y), y)
+        self.bottoms = tuple(sorted(lowest.items()))
+
+
+# PIECES[shape_index][rotation] -> PieceShape
+PIECES = [tuple(PieceShape(pattern) for pattern in shape) for shape in SHAPES]
+
+
+class Board:
+    # The playfield. rows[y] is a bitmask of occupied columns (bit x = column x)
+    # and is what every rule check uses; cells[y][x] keeps the colour index
+    # (0 means empty, otherwise shape_index + 1) for drawing.
+    # heights[x] is the skyline: GRID_HEIGHT minus the topmost occupied row
+    # of column x (0 for an empty column), kept up to date by lock and clear_lines.
+    # dirty has bit y set for every row changed since a renderer last reset it.
+    __slots__ = ('rows', 'cells', 'heights', 'dirty')
+
+    def __init__(self):
+        self.rows = [0] * GRID_HEIGHT
+        self.cells = [[0] * GRID_WIDTH for _ in range(GRID_HEIGHT)]
+        self.heights = [0] * GRID_WIDTH
+        self.dirty = ALL_ROWS
+
+    def collides(self, piece, x, y):
+        if x + piece.left < 0 or x + piece.right >= GRID_WIDTH or y + piece.bottom >= GRID_HEIGHT:
+            return True
+        shift = x + piece.left
+        rows = self.rows
+        for dy, mask in piece.rows:
+            row_y = y + dy
+            if row_y >= 0 and rows[row_y] & (mask << shift):
+                return True
+        return False
+
+    def lock(self, piece, x, y, color_index):
+        shift = x + piece.left
+        rows = self.rows
+        for dy, mask in piece.rows:
+            row_y = y + dy
+            if row_y >= 0:  # Only add to grid if it's visible
+                rows[row_y] |= mask << shift
+                self.dirty |= 1 << row_y
+        cells = self.cells
+        heights = self.heights
+        for dx, dy in piece.cells:
+            if y + dy >= 0:
+                cells[y + dy][x + dx] = color_index
+                if GRID_HEIGHT - (y + dy) > heights[x + dx]:
+                    heights[x + dx] = GRID_HEIGHT - (y + dy)
+
+    def drop_distance(self, piece, x, y):
+        # How many rows the piece can fall from (x, y). When the piece sits above
+        # the skyline in every column it covers this is O(piece width); tucked under
+        # an overhang it falls back to stepping the collision test.
+        heights = self.heights
+        distance = GRID_HEIGHT
+        for dx, dy in piece.bottoms:
+            surface = GRID_HEIGHT - heights[x + dx]
+            gap = surface - 1 - (y + dy)
+            if gap < 0:
+                distance = 0
+                while not self.collides(piece, x, y + distance + 1):
+                    distance += 1
+                return distance
+            if gap < distance:
+                distance = gap
+        return distance
+
+    def clear_lines(self):
+        # Compact the surviving rows towards the bottom in a single pass.
+        # Returns the indices of the cleared rows (top to bottom), or an empty list.
+        rows = self.rows
+        cleared = [y for y in range(GRID_HEIGHT) if rows[y] == FULL_ROW]
+        if not cleared:
+            return cleared
+
+        cells = self.cells
+        write = GRID_HEIGHT - 1
+        for read in range(GRID_HEIGHT - 1, -1, -1):
+            if rows[read] != FULL_ROW:
+                if write != read:
+                    rows[write] = rows[read]
+                    cells[write] = cells[read]
+                write -= 1
+        for y in range(write + 1):
+            rows[y] = 0
+            cells[y] = [0] * GRID_WIDTH
+        # Everything above the lowest cleared row has shifted
+        self.dirty |= (1 << (cleared[-1] + 1)) - 1
+
+        # Every cleared row was full, so it lies under each column's top: columns
+        # whose top survived just sink, the rest need their new top found
+        count = len(cleared)
+        heights = self.heights
+        for x in range(GRID_WIDTH):
+            top = GRID_HEIGHT - heights[x]
+            if top in cleared:
+                bit = 1 << x
+                y = 0
+                while y < GRID_HEIGHT and not rows[y] & bit:
+                    y += 1
+                heights[x] = GRID_HEIGHT - y
+            else:
+                heights[x] -= count
+        return cleared
@@ -0,0 +1,179 @@
+# Game rules and state, independent of pygame. A GameState holds everything
+# about one game, and step() advances it, so any number of games can run side
+# by side in one process (bots, replay checks, servers) and the interactive
+# client in main.py is just one more caller.
+import random
+
+from engine import GRID_WIDTH, SHAPES, PIECES, Board
+
+# Input actions for step(), combined as bit flags
+MOVE_LEFT = 1
+MOVE_RIGHT = 2
+SOFT_DROP = 4
+ROTATE = 8
+HARD_DROP = 16
+PAUSE = 32
+RESTART = 64
+
+# Points for clearing 1-4 lines at once, multiplied by the level
+LINE_SCORES = [100, 300, 500, 800]
+
+NO_LINES = ()
+
+
+def fall_speed(level):
+    # Seconds between gravity steps
+    return max(0.05, 0.5 - (level - 1) * 0.05)
+
+
+class Tetromino:
+    __slots__ = ('shape_index', 'shape', 'rotation', 'x', 'y')
+
+    def __init__(self, shape_index):
+        self.shape_index = shape_index
+        self.shape = PIECES[shape_index]
+        self.rotation = 0
+        self.x = GRID_WIDTH // 2 - 2
+        self.y = 0
+
+    def copy(self):
+        piece = Tetromino(self.shape_index)
+        piece.rotation = self.rotation
+        piece.x = self.x
+        piece.y = self.y
+        return piece
+
+    def get_shape(self):
+        return self.shape[self.rotation % len(self.shape)]
+
+    def rotate(self, board):
+        self.rotation = (self.rotation + 1) % len(self.shape)
+        if not self.is_valid_position(board):
+            self.rotation = (self.rotation - 1) % len(self.shape)
+
+    def is_valid_position(self, board):
+        return not board.collides(self.get_shape(), self.x, self.y)
+
+    def drop_distance(self, board):
+        return board.drop_distance(self.get_shape(), self.x, self.y)
+
+    def hard_drop(self, board):
+        # Skyline lookup instead of stepping move(0, 1) row by row
+        self.y += board.drop_distance(self.get_shape(), self.x, self.y)
+
+    def move(self, board, dx, dy):
+        self.x += dx
+        self.y += dy
+        if not self.is_valid_position(board):
+            self.x -= dx
+            self.y -= dy
+            return False
+        return True
+
+
+class GameState:
+    __slots__ = ('board', 'score', 'level', 'lines_cleared', 'current', 'next',
+                 'fall_time', 'game_over', 'paused', 'pieces_placed', 'rng')
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.paused = False
+        self.reset()
+
+    def reset(self):
+        self.board = Board()
+        self.score = 0
+        self.level = 1
+        self.lines_cleared = 0
+        self.fall_time = 0
+        self.game_over = False
+        self.pieces_placed = 0
+        self.current = self.new_piece()
+        self.next = self.new_piece()
+
+    def new_piece(self):
+        return Tetromino(self.rng.randint(0, len(SHAPES) - 1))
+
+    def copy(self):
+        # Independent copy, e.g. for a bot to look ahead without touching the real game
+        state = GameState.__new__(GameState)
+        board = Board.__new__(Board)
+        board.rows = self.board.rows[:]
+        board.cells = [row[:] for row in self.board.cells]
+        board.heights = self.board.heights[:]
+        board.dirty = self.board.dirty
+        state.board = board
+        state.score = self.score
+        state.level = self.level
+        state.lines_cleared = self.lines_cleared
+        state.current = self.current.copy()
+        state.next = self.next.copy()
+        state.fall_time = self.fall_time
+        state.game_over = self.game_over
+        state.paused = self.paused
+        state.pieces_placed = self.pieces_placed
+        state.rng = random.Random()
+        state.rng.setstate(self.rng.getstate())
+        return state
+
+
+def check_lines(state):
+    # Full rows are found and removed in one pass over the row bitmasks
+    lines_to_clear = state.board.clear_lines()
+
+    if lines_to_clear:
+        # Update score
+        num_lines = len(lines_to_clear)
+        state.score += LINE_SCORES[min(num_lines - 1, 3)] * state.level
+        state.lines_cleared += num_lines
+        state.level = state.lines_cleared // 10 + 1
+    return lines_to_clear
+
+
+def lock_and_spawn(state):
+    # Lock the current piece, clear lines and bring in the next one.
+    # Returns the cleared row indices.
+    piece = state.current
+    state.board.lock(piece.get_shape(), piece.x, piece.y, piece.shape_index + 1)
+    state.pieces_placed += 1
+    cleared = check_lines(state)
+    state.current = state.next
+    state.next = state.new_piece()
+
+    if not state.current.is_valid_position(state.board):
+        state.game_over = True
+    return cleared
+
+
+def step(state, actions, dt):
+    # Apply this step's input actions, then advance gravity by dt seconds.
+    # Returns the rows cleared during the step (usually none).
+    if actions & PAUSE:
+        state.paused = not state.paused
+    if actions & RESTART and state.game_over:
+        state.reset()
+    if state.game_over or state.paused:
+        return NO_LINES
+
+    board = state.board
+    piece = state.current
+    if actions & MOVE_LEFT:
+        piece.move(board, -1, 0)
+    if actions & MOVE_RIGHT:
+        piece.move(board, 1, 0)
+    if actions & ROTATE:
+        piece.rotate(board)
+    if actions & SOFT_DROP and piece.move(board, 0, 1):
+        state.fall_time = 0
+    if actions & HARD_DROP:
+        piece.hard_drop(board)
+        state.fall_time = 0
+        return lock_and_spawn(state)
+
+    state.fall_time += dt
+    if state.fall_time >= fall_speed(state.level):
+        state.fall_time = 0
+        if not piece.move(board, 0, 1):
+            # Can't move down, lock the tetromino in place
+            return lock_and_spawn(state)
+    return NO_LINES
@@ -1,15 +1,56 @@
 import pygame
+import os
 import sys
-import random
 import asyncio
+import random
+
+from engine import GRID_WIDTH, GRID_HEIGHT
+from game import GameState, step, MOVE_LEFT, MOVE_RIGHT, SOFT_DROP, ROTATE, HARD_DROP, PAUSE, RESTART
+from render import GHOST, HINT, BoardRenderer, LayerCache, TextCache
+from pacing import FixedTimestep, FramePacer
+from controls import AutoRepeat, HitMap
+from bot import Bot
+from replay import Recorder
+from snapshot import dumps, loads
+from scores import Leaderboard, TOP_K
+import storage
+from profiler import FrameProfiler
+from effects import Effects
 
 # Initialize Pygame
-pygame.init()
+# Only the display and fonts are used; pygame.init() would also bring up audio
+# and the other subsystems before anything reaches the screen
+pygame.display.init()
+pygame.font.init()
 
 # Set up the display
+# The game is drawn into a logical surface of fixed height and scaled onto the
+# window once per present, so fill cost doesn't grow with the device screen
+LOGICAL_HEIGHT = 600
+MIN_LOGICAL_WIDTH = 800
+MAX_LOGICAL_WIDTH = 1280
 width, height = 800, 600
-screen = pygame.display.set_mode((width, height))  # Remove RESIZABLE flag
+
+def window_size():
+    # Under pygbag the canvas gets one pixel per device pixel of the page, so
+    # high-DPI phones see the game's own scaling (crisp at whole-number scales)
+    # rather than the browser stretching an 800x600 canvas
+    if sys.platform != 'emscripten':
+        return (width, height)
+    import platform
+    ratio = platform.window.devicePixelRatio or 1
+    return (int(platform.window.innerWidth * ratio), int(platform.window.innerHeight * ratio))
+
+# The browser sizes the pygbag canvas itself, so only desktop windows are RESIZABLE
+display_flags = 0 if sys.platform == 'emscripten' else pygame.RESIZABLE
+window = pygame.display.set_mode(window_size(), display_flags)
 pygame.display.set_caption("Tetris Game")
+screen = pygame.Surface((width, height))
+
+# How the logical surface maps onto the window
+present_scale = 1
+present_offset = (0, 0)
+present_buffer = None
 
 # Colors
 BLACK = (0, 0, 0)
@@ -25,8 +66,6 @@ PURPLE = (128, 0, 128)
 
 # Game settings
 GRID_SIZE = 30
-GRID_WIDTH = 10
-GRID_HEIGHT = 20
 GRID_MARGIN = 1
 
 # Calculate board position to center it
@@ -35,137 +74,40 @@ BOARD_HEIGHT = GRID_HEIGHT * (GRID_SIZE + GRID_MARGIN) + GRID_MARGIN
 BOARD_X = (width - BOARD_WIDTH) // 2
 BOARD_Y = (height - BOARD_HEIGHT) // 2
 
-# Tetromino shapes
-SHAPES = [
-    # I piece
-    [
-        ['.....',
-         '.....',
-         'IIII.',
-         '.....',
-         '.....'],
-        ['..I..',
-         '..I..',
-         '..I..',
-         '..I..',
-         '.....']
-    ],
-    # J piece
-    [
-        ['.....',
-         '.J...',
-         '.JJJ.',
-         '.....',
-         '.....'],
-        ['.....',
-         '..JJ.',
-         '..J..',
-         '..J..',
-         '.....'],
-        ['.....',
-         '.....',
-         '.JJJ.',
-         '...J.',
-         '.....'],
-        ['.....',
-         '..J..',
-         '..J..',
-         '.JJ..',
-         '.....']
-    ],
-    # L piece
-    [
-        ['.....',
-         '...L.',
-         '.LLL.',
-         '.....',
-         '.....'],
-        ['.....',
-         '..L..',
-         '..L..',
-         '..LL.',
-         '.....'],
-        ['.....',
-         '.....',
-         '.LLL.',
-         '.L...',
-         '.....'],
-        ['.....',
-         '.LL..',
-         '..L..',
-         '..L..',
-         '.....']
-    ],
-    # O piece
-    [
-        ['.....',
-         '.....',
-         '.OO..',
-         '.OO..',
-         '.....']
-    ],
-    # S piece
-    [
-        ['.....',
-         '.....',
-         '..SS.',
-         '.SS..',
-         '.....'],
-        ['.....',
-         '..S..',
-         '..SS.',
-         '...S.',
-         '.....']
-    ],
-    # T piece
-    [
-        ['.....',
-         '..T..',
-         '.TTT.',
-         '.....',
-         '.....'],
-        ['.....',
-         '..T..',
-         '..TT.',
-         '..T..',
-         '.....'],
-        ['.....',
-         '.....',
-         '.TTT.',
-         '..T..',
-         '.....'],
-        ['.....',
-         '..T..',
-         '.TT..',
-         '..T..',
-         '.....']
-    ],
-    # Z piece
-    [
-        ['.....',
-         '.....',
-         '.ZZ..',
-         '..ZZ.',
-         '.....'],
-        ['.....',
-         '...Z.',
-         '..ZZ.',
-         '..Z..',
-         '.....']
-    ]
-]
-
 # Colors for each shape
 SHAPE_COLORS = [CYAN, BLUE, ORANGE, YELLOW, GREEN, PURPLE, RED]
 
-# Game variables
-score = 0
-level = 1
-lines_cleared = 0
-game_over = False
-paused = False
-font = pygame.font.SysFont('Arial', 24)
-big_font = pygame.font.SysFont('Arial', 48)
+# Display options
+show_ghost = True  # Toggle with G
+show_hint = False  # Toggle with H or the hint button
+
+# Built-in AI for hints and autoplay (toggle with A)
+bot = Bot()
+autoplay = False
+autoplay_time = 0
+AUTOPLAY_INTERVAL = 0.1  # seconds per piece
+hint_piece = None
+hint_cells = ()
+
+# Frame profiler, toggled with F3 (or on from the start with --profile); F4
+# saves a trace. It stays None while off, so the loop only pays for a few
+# truth tests. Its HUD sits under the score and is redrawn twice a second.
+profiler = FrameProfiler() if '--profile' in sys.argv else None
+profiler_font = None
+profiler_hud = None
+profiler_frame = 0
+PROFILER_REFRESH_FRAMES = 30
+# Traces go beside the saves, out of the game's folder
+TRACE_PATH = storage.path('frame_trace.json')
+
+# Fonts are loaded by load_assets() after the first frame is on screen
+font = None
+big_font = None
+button_font = None
+label_font = None
+
+# Rendered text is reused until its string or colour changes
+text_cache = TextCache()
 
 # On-screen controls for mobile
 button_size = 70
@@ -191,185 +133,397 @@ buttons = {
     'pause': {'rect': pygame.Rect(width - button_size - button_margin, button_margin, button_size, button_size),
               'text': '⏸', 'action': 'P', 'color': (50, 200, 50)},
     'restart': {'rect': pygame.Rect(width - 2*button_size - 2*button_margin, button_margin, button_size, button_size),
-               'text': '↺', 'action': 'R', 'color': (200, 200, 50)}
+               'text': '↺', 'action': 'R', 'color': (200, 200, 50)},
+    'hint': {'rect': pygame.Rect(button_margin, button_margin, button_size, button_size),
+             'text': '?', 'action': 'H', 'color': (150, 80, 200)}
 }
 
-# Track which buttons are being pressed
+# Track which buttons are being pressed, and by how many pointers
 button_states = {key: False for key in buttons}
+button_holds = {key: 0 for key in buttons}
 
-# Create the game grid (0 means empty)
-grid = [[0 for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
-
-class Tetromino:
-    def __init__(self):
-        self.shape_index = random.randint(0, len(SHAPES) - 1)
-        self.shape = SHAPES[self.shape_index]
-        self.color = SHAPE_COLORS[self.shape_index]
-        self.rotation = 0
-        self.x = GRID_WIDTH // 2 - 2
-        self.y = 0
-        
-    def get_shape(self):
-        return self.shape[self.rotation % len(self.shape)]
-    
-    def rotate(self):
-        self.rotation = (self.rotation + 1) % len(self.shape)
-        if not self.is_valid_position():
-            self.rotation = (self.rotation - 1) % len(self.shape)
-
-    def is_valid_position(self):
-        shape = self.get_shape()
-        for y, row in enumerate(shape):
-            for x, cell in enumerate(row):
-                if cell != '.':
-                    pos_x = self.x + x
-                    pos_y = self.y + y
-                    
-                    if (pos_x < 0 or pos_x >= GRID_WIDTH or 
-                        pos_y >= GRID_HEIGHT or 
-                        (pos_y >= 0 and grid[pos_y][pos_x] != 0)):
-                        return False
-        return True
-    
-    def move(self, dx, dy):
-        self.x += dx
-        self.y += dy
-        if not self.is_valid_position():
-            self.x -= dx
-            self.y -= dy
-            return False
-        return True
+# Which button each finger (or the mouse) is currently on
+pointers = {}
+
+# Held directions repeat with delayed auto-shift instead of pygame key repeat
+repeat = AutoRepeat()
+DIRECTION_KEYS = {pygame.K_LEFT: 'left', pygame.K_RIGHT: 'right', pygame.K_DOWN: 'down'}
+DIRECTION_ACTIONS = ('LEFT', 'RIGHT', 'DOWN')
+DIRECTION_MOVES = {'left': MOVE_LEFT, 'right': MOVE_RIGHT, 'down': SOFT_DROP}
+
+def update_hint():
+    # The bot is asked once per piece; the answer is kept until the next spawn
+    global hint_piece, hint_cells
     
-    def draw(self):
-        shape = self.get_shape()
-        for y, row in enumerate(shape):
-            for x, cell in enumerate(row):
-                if cell != '.':
-                    draw_x = BOARD_X + (self.x + x) * (GRID_SIZE + GRID_MARGIN) + GRID_MARGIN
-                    draw_y = BOARD_Y + (self.y + y) * (GRID_SIZE + GRID_MARGIN) + GRID_MARGIN
-                    pygame.draw.rect(screen, self.color, (draw_x, draw_y, GRID_SIZE, GRID_SIZE))
-
-def create_new_tetromino():
-    return Tetromino()
+    if hint_piece is state.current:
+        return
+    hint_piece = state.current
+    choice = bot.choose(state)
+    if choice is None:
+        hint_cells = ()
+        return
+    rotation, hint_x, hint_y, _ = choice
+    hint_cells = [(hint_x + x, hint_y + y) for x, y in state.current.shape[rotation].cells if hint_y + y >= 0]
 
 def draw_grid():
-    # Draw the background
-    pygame.draw.rect(screen, WHITE, (BOARD_X, BOARD_Y, BOARD_WIDTH, BOARD_HEIGHT))
-    
-    # Draw the grid cells
-    for y in range(GRID_HEIGHT):
-        for x in range(GRID_WIDTH):
-            draw_x = BOARD_X + x * (GRID_SIZE + GRID_MARGIN) + GRID_MARGIN
-            draw_y = BOARD_Y + y * (GRID_SIZE + GRID_MARGIN) + GRID_MARGIN
-            
-            if grid[y][x] == 0:
-                pygame.draw.rect(screen, BLACK, (draw_x, draw_y, GRID_SIZE, GRID_SIZE))
-            else:
-                pygame.draw.rect(screen, SHAPE_COLORS[grid[y][x] - 1], (draw_x, draw_y, GRID_SIZE, GRID_SIZE))
+    # Repaint only the board cells that changed since the last frame and
+    # return them as dirty rects in screen coordinates. The list and its rects
+    # are reused, so they only hold until the next call.
+    board_rects.clear()
+    if not state.game_over and not state.paused:
+        overlay = board_renderer.overlay
+        # Where the bot would put the piece, under the ghost and the piece itself
+        if show_hint:
+            update_hint()
+            for x, y in hint_cells:
+                overlay.set(x, y, HINT)
+        
+        # The falling piece and its ghost are drawn into the overlay, keyed by cell
+        piece = state.current
+        shape = piece.get_shape()
+        code = piece.shape_index + 1
+        if show_ghost:
+            # Outline where the piece would land on a hard drop
+            ghost_y = piece.y + piece.drop_distance(state.board)
+            for x, y in shape.cells:
+                if ghost_y + y >= 0:
+                    overlay.set(piece.x + x, ghost_y + y, GHOST + code)
+        for x, y in shape.cells:
+            if piece.y + y >= 0:
+                overlay.set(piece.x + x, piece.y + y, code)
+    board_renderer.update(state.board, board_rects, BOARD_X, BOARD_Y)
+    return board_rects
 
-def draw_controls():
-    button_font = pygame.font.SysFont('Arial', 36)
-    
-    for button_name, button_data in buttons.items():
-        # Determine button color based on state
-        if button_states[button_name]:
-            base_color = button_press_color
-        else:
-            base_color = button_color
-            
+def build_layer(key):
+    # Pre-render one static layer: ('button', name, pressed) or ('overlay', kind)
+    if key[0] == 'button':
+        _, button_name, pressed = key
+        button_data = buttons[button_name]
+        area = control_areas[button_name]
+        layer = pygame.Surface(area.size, pygame.SRCALPHA)
+        rect = button_data['rect'].move(-area.x, -area.y)
+        
         # Create a rounded rectangle for the button
-        pygame.draw.rect(screen, button_data['color'], button_data['rect'], 0, 15)
-        pygame.draw.rect(screen, WHITE, button_data['rect'], 3, 15)
+        pygame.draw.rect(layer, button_press_color if pressed else button_data['color'], rect, 0, 15)
+        pygame.draw.rect(layer, WHITE, rect, 3, 15)
         
         # Draw button text
         text = button_font.render(button_data['text'], True, WHITE)
-        text_rect = text.get_rect(center=button_data['rect'].center)
-        screen.blit(text, text_rect)
+        layer.blit(text, text.get_rect(center=rect.center))
         
         # Add a label below certain buttons
         if button_name in ['rotate', 'drop']:
-            label_font = pygame.font.SysFont('Arial', 16)
             label_text = "Rotate" if button_name == 'rotate' else "Drop"
             label = label_font.render(label_text, True, WHITE)
-            label_rect = label.get_rect(midtop=(button_data['rect'].centerx, button_data['rect'].bottom + 5))
-            screen.blit(label, label_rect)
+            layer.blit(label, label.get_rect(midtop=(rect.centerx, rect.bottom + 5)))
+        return layer
+    
+    # Dimmed full-screen overlay with its two lines of text
+    if key[1] == 'game_over':
+        title = big_font.render("GAME OVER", True, RED)
+        hint = font.render("Press R to restart", True, WHITE)
+    else:
+        title = big_font.render("PAUSED", True, YELLOW)
+        hint = font.render("Press P to continue", True, WHITE)
+    layer = pygame.Surface((width, height), pygame.SRCALPHA)
+    layer.fill((0, 0, 0, 128))
+    layer.blit(title, (width // 2 - title.get_width() // 2, height // 2 - 50))
+    layer.blit(hint, (width // 2 - hint.get_width() // 2, height // 2 + 20))
+    return layer
+
+def draw_controls():
+    # Idle and pressed variants of each button are pre-rendered layers
+    screen.blits([(layers.get(('button', button_name, button_states[button_name])), control_areas[button_name])
+                  for button_name in buttons])
 
 def draw_score():
-    score_text = font.render(f"Score: {score}", True, WHITE)
-    level_text = font.render(f"Level: {level}", True, WHITE)
-    lines_text = font.render(f"Lines: {lines_cleared}", True, WHITE)
+    # Only re-rendered when the values change, otherwise served from the cache
+    score_text = text_cache.render(font, f"Score: {state.score}", True, WHITE)
+    level_text = text_cache.render(font, f"Level: {state.level}", True, WHITE)
+    lines_text = text_cache.render(font, f"Lines: {state.lines_cleared}", True, WHITE)
     
     screen.blit(score_text, (BOARD_X + BOARD_WIDTH + 20, BOARD_Y))
     screen.blit(level_text, (BOARD_X + BOARD_WIDTH + 20, BOARD_Y + 40))
     screen.blit(lines_text, (BOARD_X + BOARD_WIDTH + 20, BOARD_Y + 80))
 
 def draw_game_over():
-    overlay = pygame.Surface((width, height))
-    overlay.fill(BLACK)
-    overlay.set_alpha(128)
-    screen.blit(overlay, (0, 0))
-    
-    game_over_text = big_font.render("GAME OVER", True, RED)
-    restart_text = font.render("Press R to restart", True, WHITE)
-    
-    screen.blit(game_over_text, (width // 2 - game_over_text.get_width() // 2, height // 2 - 50))
-    screen.blit(restart_text, (width // 2 - restart_text.get_width() // 2, height // 2 + 20))
+    screen.blit(layers.get(('overlay', 'game_over')), (0, 0))
+    # Where this game placed, under the overlay's text
+    standing = f"Rank #{final_rank}" if final_rank else f"Outside the top {TOP_K}"
+    text = text_cache.render(font, f"{standing}   Best: {leaderboard.best()}", True, YELLOW)
+    screen.blit(text, (width // 2 - text.get_width() // 2, height // 2 + 60))
 
 def draw_pause():
-    overlay = pygame.Surface((width, height))
-    overlay.fill(BLACK)
-    overlay.set_alpha(128)
-    screen.blit(overlay, (0, 0))
+    screen.blit(layers.get(('overlay', 'paused')), (0, 0))
+
+def update_layout():
+    # Screen areas of the score, the profiler HUD and each button (including
+    # the label under rotate and drop), worked out when the layout changes
+    # rather than every frame
+    screen_rect = screen.get_rect()
+    if font is not None:
+        hud_area.update(pygame.Rect(BOARD_X + BOARD_WIDTH + 20, BOARD_Y, width, 80 + font.get_linesize()).clip(screen_rect))
+    if profiler_hud is not None:
+        profiler_area.update(profiler_hud.get_rect(topleft=(hud_area.x, hud_area.bottom + 10)).clip(screen_rect))
+    control_area_list.clear()
+    for button_name, button_data in buttons.items():
+        rect = button_data['rect']
+        if button_name in ['rotate', 'drop']:
+            rect = rect.inflate(0, 50).move(0, 25)
+        control_areas[button_name] = rect
+        control_area_list.append(rect)
+
+def clip_to_screen(rect):
+    # Rect.clip() against the screen, in place
+    left = max(rect.left, 0)
+    top = max(rect.top, 0)
+    rect.update(left, top, max(0, min(rect.right, width) - left), max(0, min(rect.bottom, height) - top))
+
+def compose(rect):
+    # Redraw every layer clipped to rect, back to front
+    screen.set_clip(rect)
+    screen.fill(BLACK, rect)
+    effects.draw_board(screen, board_renderer.surface, BOARD_X, BOARD_Y)
+    if effects.active:
+        effects.draw(screen, BOARD_X, BOARD_Y)
+    if profiler:
+        profiler.mark('compose')
+    if rect.colliderect(hud_area):
+        draw_score()
+        if profiler:
+            profiler.mark('text')
+    if rect.collidelist(control_area_list) != -1:
+        draw_controls()
+        if profiler:
+            profiler.mark('controls')
+    if state.game_over:
+        draw_game_over()
+    elif state.paused:
+        draw_pause()
+    if profiler_hud is not None and rect.colliderect(profiler_area):
+        screen.blit(profiler_hud, profiler_area)
+    screen.set_clip(None)
+    if profiler:
+        profiler.mark('compose')
+
+def draw_first_frame():
+    # The empty board, which needs no fonts, shown while the rest loads
+    board_renderer.update(state.board)
+    screen.fill(BLACK)
+    screen.blit(board_renderer.surface, (BOARD_X, BOARD_Y))
+    present()
+
+async def load_assets():
+    # Fonts and the button layers, one at a time, yielding in between so the
+    # browser keeps painting while they load
+    global font, big_font, button_font, label_font
+    font = pygame.font.SysFont('Arial', 24)
+    await asyncio.sleep(0)
+    big_font = pygame.font.SysFont('Arial', 48)
+    await asyncio.sleep(0)
+    button_font = pygame.font.SysFont('Arial', 36)
+    await asyncio.sleep(0)
+    label_font = pygame.font.SysFont('Arial', 16)
+    update_layout()
+    await asyncio.sleep(0)
+    leaderboard.load()
+    # Pressed layers too, so a press never renders text on the input frame
+    for button_name in buttons:
+        for pressed in (False, True):
+            await asyncio.sleep(0)
+            layers.get(('button', button_name, pressed))
+
+def save_game():
+    # A finished game has nothing to resume, so its save is dropped
+    global autosave_time
+    autosave_time = 0
+    if state.game_over:
+        storage.remove(SAVE_KEY)
+    else:
+        storage.write(SAVE_KEY, dumps(state))
+
+def restore_game():
+    # Carry on from the last save, paused so the player can find their place
+    global state, record_path
+    data = storage.read(SAVE_KEY)
+    if data is None:
+        return
+    try:
+        restored = loads(data)
+    except ValueError:
+        storage.remove(SAVE_KEY)
+        return
+    restored.paused = True
+    state = restored
+    effects.reset()
+    # The replay can't reach this game from its seed, so none is written
+    record_path = None
+
+def refresh_profiler_hud(dirty_rects):
+    # Re-render the profiler HUD, adding the areas to repaint, old and new, to dirty_rects
+    global profiler_font, profiler_hud, profiler_frame
+    if profiler_font is None:
+        # Columns of numbers line up best in a monospaced font
+        profiler_font = pygame.font.SysFont('Courier New, monospace', 14)
+    if profiler_hud is not None:
+        dirty_rects.append(profiler_area.copy())
+    profiler_hud = profiler.render_hud(profiler_font)
+    profiler_frame = profiler.frames
+    update_layout()
+    dirty_rects.append(profiler_area)
+
+def toggle_profiler():
+    # Start profiling with its HUD, or stop and drop both
+    global profiler, profiler_hud, profiler_frame, drawn_view
+    if profiler:
+        profiler = None
+        profiler_hud = None
+    else:
+        profiler = FrameProfiler()
+        profiler_frame = -PROFILER_REFRESH_FRAMES
+    # Repaint the whole screen with or without the HUD
+    drawn_view = None
+
+def draw_frame():
+    # Runs every frame, so when nothing has changed it allocates nothing: the
+    # dirty rects come in a reused list, the view is a small int rather than
+    # a tuple, and the areas to repaint are Rects kept from frame to frame
+    global drawn_view, effects_drawn
     
-    pause_text = big_font.render("PAUSED", True, YELLOW)
-    continue_text = font.render("Press P to continue", True, WHITE)
+    dirty_rects = draw_grid()
+    view = state.game_over * 2 + state.paused
     
-    screen.blit(pause_text, (width // 2 - pause_text.get_width() // 2, height // 2 - 50))
-    screen.blit(continue_text, (width // 2 - continue_text.get_width() // 2, height // 2 + 20))
-
-def check_lines():
-    global grid, score, level, lines_cleared
+    if profiler:
+        profiler.mark('board')
+        if profiler.frames >= profiler_frame + PROFILER_REFRESH_FRAMES:
+            refresh_profiler_hud(dirty_rects)
+            profiler.mark('text')
     
-    lines_to_clear = []
-    for y in range(GRID_HEIGHT):
-        if all(grid[y][x] != 0 for x in range(GRID_WIDTH)):
-            lines_to_clear.append(y)
+    # Switching between playing, paused and game over changes the whole screen
+    if view != drawn_view:
+        compose(screen.get_rect())
+        present()
+        if profiler:
+            profiler.mark('present')
+        drawn_view = view
+        drawn_hud[:] = state.score, state.level, state.lines_cleared
+        drawn_buttons.update(button_states)
+        return
     
-    if lines_to_clear:
-        # Update score
-        num_lines = len(lines_to_clear)
-        score += [100, 300, 500, 800][min(num_lines - 1, 3)] * level
-        lines_cleared += num_lines
-        level = lines_cleared // 10 + 1
-        
-        # Remove the lines
-        for line in lines_to_clear:
-            for y in range(line, 0, -1):
-                grid[y] = grid[y - 1][:]
-            grid[0] = [0] * GRID_WIDTH
-
-def lock_tetromino(tetromino):
-    shape = tetromino.get_shape()
-    for y, row in enumerate(shape):
-        for x, cell in enumerate(row):
-            if cell != '.':
-                if tetromino.y + y >= 0:  # Only add to grid if it's visible
-                    grid[tetromino.y + y][tetromino.x + x] = tetromino.shape_index + 1
-
-def reset_game():
-    global grid, score, level, lines_cleared, game_over, current_tetromino, next_tetromino
+    # Effects move every frame: repaint where they are now and where they were
+    if effects.active or effects_drawn:
+        effects_dirty.update(effects_area)
+        if effects.active:
+            effects_area.update(effects.bounds)
+            effects_area.move_ip(BOARD_X, BOARD_Y)
+            if effects_drawn:
+                effects_dirty.union_ip(effects_area)
+            else:
+                effects_dirty.update(effects_area)
+        clip_to_screen(effects_dirty)
+        dirty_rects.append(effects_dirty)
+        effects_drawn = effects.active
+    if state.score != drawn_hud[0] or state.level != drawn_hud[1] or state.lines_cleared != drawn_hud[2]:
+        dirty_rects.append(hud_area)
+        drawn_hud[:] = state.score, state.level, state.lines_cleared
+    
+    # Buttons that were pressed or released switch to their other layer
+    for button_name in buttons:
+        pressed = button_states[button_name]
+        if drawn_buttons[button_name] != pressed:
+            dirty_rects.append(control_areas[button_name])
+            drawn_buttons[button_name] = pressed
+    
+    for rect in dirty_rects:
+        compose(rect)
+    if dirty_rects:
+        present(dirty_rects)
+    if profiler:
+        profiler.mark('present')
+
+def apply(actions):
+    # Input takes effect immediately, as a zero-length step of the game
+    recorder.record(actions)
+    if actions & HARD_DROP and not state.game_over and not state.paused:
+        piece = state.current
+        effects.hard_drop(piece.get_shape(), piece.x, piece.y, piece.drop_distance(state.board), piece.shape_index)
+    if actions & RESTART and state.game_over:
+        # The old game's effects don't carry over onto the new board
+        effects.reset()
+    cleared = step(state, actions, 0)
+    if cleared:
+        effects.line_clear(cleared)
+
+def press_direction(direction, now):
+    # Move once straight away; AutoRepeat takes over if it stays held
+    if repeat.press(direction, now):
+        apply(DIRECTION_MOVES[direction])
+
+def press_button(button_name, now):
+    global show_hint
     
-    grid = [[0 for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
-    score = 0
-    level = 1
-    lines_cleared = 0
-    game_over = False
+    button_holds[button_name] += 1
+    if button_holds[button_name] > 1:
+        return
+    button_states[button_name] = True
     
-    current_tetromino = create_new_tetromino()
-    next_tetromino = create_new_tetromino()
+    # Handle immediate button actions
+    action = buttons[button_name]['action']
+    if action in DIRECTION_ACTIONS:
+        if not state.game_over and not state.paused:
+            press_direction(button_name, now)
+    elif action == 'P':
+        apply(PAUSE)
+    elif action == 'R':
+        apply(RESTART)
+    elif action == 'ROTATE':
+        apply(ROTATE)
+    elif action == 'H':
+        show_hint = not show_hint
+
+def release_button(button_name, on_button):
+    button_holds[button_name] -= 1
+    if button_holds[button_name] > 0:
+        return
+    button_holds[button_name] = 0
+    button_states[button_name] = False
+    
+    # Handle button release actions for certain buttons
+    action = buttons[button_name]['action']
+    if action in DIRECTION_ACTIONS:
+        repeat.release(button_name)
+    elif action == 'SPACE' and on_button:
+        apply(HARD_DROP)
+
+def pointer_down(pointer, pos, now):
+    button_name = hit_map.button_at(pos)
+    pointers[pointer] = button_name
+    if button_name is not None:
+        press_button(button_name, now)
+
+def pointer_move(pointer, pos, now):
+    # Sliding a finger across the d-pad hands the press over to the new direction
+    if pointer not in pointers:
+        return
+    button_name = pointers[pointer]
+    over = hit_map.button_at(pos)
+    if over == button_name:
+        return
+    if button_name is not None:
+        release_button(button_name, False)
+    if over is not None and buttons[over]['action'] in DIRECTION_ACTIONS:
+        pointers[pointer] = over
+        press_button(over, now)
+    else:
+        pointers[pointer] = None
+
+def pointer_up(pointer, pos):
+    button_name = pointers.pop(pointer, None)
+    if button_name is not None:
+        release_button(button_name, hit_map.button_at(pos) == button_name)
 
 def update_button_positions():
-    global buttons
+    global buttons, hit_map
     
     # Update button positions based on current screen size
     # D-pad layout
@@ -385,157 +539,295 @@ def update_button_positions():
     # Menu buttons at the top
     buttons['pause']['rect'] = pygame.Rect(width - button_size - button_margin, button_margin, button_size, button_size)
     buttons['restart']['rect'] = pygame.Rect(width - 2*button_size - 2*button_margin, button_margin, button_size, button_size)
+    buttons['hint']['rect'] = pygame.Rect(button_margin, button_margin, button_size, button_size)
+    
+    # Overlays are sized to the screen, so rebuild every layer; the buttons'
+    # straight away once their font is loaded, rather than on their next press
+    layers.invalidate()
+    hit_map = HitMap(buttons, (width, height))
+    update_layout()
+    if button_font is not None:
+        for button_name in buttons:
+            for pressed in (False, True):
+                layers.get(('button', button_name, pressed))
+
+def resize_display():
+    global window, screen, width, height, BOARD_X, BOARD_Y
+    global present_scale, present_offset, present_buffer, drawn_view
+    
+    # Keep the logical height fixed and follow the window's aspect ratio within limits
+    window = pygame.display.get_surface()
+    window_width, window_height = window.get_size()
+    height = LOGICAL_HEIGHT
+    width = min(max(MIN_LOGICAL_WIDTH, window_width * height // max(1, window_height)), MAX_LOGICAL_WIDTH)
+    if screen.get_size() != (width, height):
+        screen = pygame.Surface((width, height))
+    BOARD_X = (width - BOARD_WIDTH) // 2
+    BOARD_Y = (height - BOARD_HEIGHT) // 2
+    update_button_positions()
+    
+    # Whole-number scales copy only the dirty rects with nearest-neighbour, which
+    # keeps blocks crisp; anything else scales the full frame into a reused buffer
+    scale = min(window_width / width, window_height / height)
+    if scale >= 1 and (scale - int(scale)) * height < 1:
+        scale = int(scale)
+    present_scale = scale
+    present_size = (int(width * scale), int(height * scale))
+    present_offset = ((window_width - present_size[0]) // 2, (window_height - present_size[1]) // 2)
+    present_buffer = None if scale == int(scale) else pygame.Surface(present_size)
+    
+    window.fill(BLACK)
+    drawn_view = None
+
+def present(dirty_rects=None):
+    # Copy the logical surface to the window with a single scale step.
+    # Without dirty_rects the whole frame, letterbox bars included, is flipped.
+    offset_x, offset_y = present_offset
+    if present_buffer is not None:
+        if present_scale < 1:
+            pygame.transform.smoothscale(screen, present_buffer.get_size(), present_buffer)
+        else:
+            pygame.transform.scale(screen, present_buffer.get_size(), present_buffer)
+        window.blit(present_buffer, present_offset)
+        pygame.display.flip()
+        return
+    
+    screen_rect = screen.get_rect()
+    rects = dirty_rects or [screen_rect]
+    scale = present_scale
+    if scale == 1:
+        window_rects = [rect.move(offset_x, offset_y) for rect in rects]
+        window.blits([(screen, window_rect, rect) for window_rect, rect in zip(window_rects, rects)], False)
+    else:
+        window_rects = []
+        for rect in rects:
+            # The board is taller than the screen, so its edge rows hang off it,
+            # and subsurface() only takes areas inside
+            rect = rect.clip(screen_rect)
+            if not rect:
+                continue
+            window_rect = pygame.Rect(offset_x + rect.x * scale, offset_y + rect.y * scale, rect.w * scale, rect.h * scale)
+            window.blit(pygame.transform.scale(screen.subsurface(rect), window_rect.size), window_rect)
+            window_rects.append(window_rect)
+    
+    if dirty_rects:
+        pygame.display.update(window_rects)
+    else:
+        pygame.display.flip()
+
+def page_hidden():
+    # Under pygbag the browser's document is reachable through the platform module
+    if sys.platform != 'emscripten':
+        return False
+    import platform
+    return bool(platform.window.document.hidden)
+
+def to_logical(pos):
+    # Map a window position (mouse or touch) onto the logical surface
+    return (int((pos[0] - present_offset[0]) / present_scale), int((pos[1] - present_offset[1]) / present_scale))
+
+def finger_pos(event):
+    # Finger events carry positions normalised to the window
+    window_width, window_height = window.get_size()
+    return to_logical((event.x * window_width, event.y * window_height))
+
+# Retained board surface; the screen is only repainted where something changed
+board_renderer = BoardRenderer(SHAPE_COLORS, GRID_SIZE, GRID_MARGIN, WHITE, BLACK)
+board_rects = []
+drawn_view = None
+drawn_hud = [None, None, None]  # score, level and lines on screen
+drawn_buttons = dict(button_states)
+
+# Screen areas set by update_layout() once the fonts are in
+hud_area = pygame.Rect(0, 0, 0, 0)
+profiler_area = pygame.Rect(0, 0, 0, 0)
+control_areas = {}
+control_area_list = []
+
+# Line-clear, hard-drop and particle effects drawn over the board, and the
+# screen area they covered last frame
+effects = Effects(board_renderer, SHAPE_COLORS)
+effects_drawn = False
+effects_area = pygame.Rect(0, 0, 0, 0)
+effects_dirty = pygame.Rect(0, 0, 0, 0)
+
+# Control pad and overlay layers, built on first use
+layers = LayerCache(build_layer)
+
+# Button lookup by screen position, rebuilt by update_button_positions()
+hit_map = HitMap(buttons, (width, height))
 
 # Initialize game
-current_tetromino = create_new_tetromino()
-next_tetromino = create_new_tetromino()
+# Every game is seeded and its inputs recorded, so it can be replayed exactly
+# (see replay.py). `main.py --record FILE` writes the replay at each game over.
+seed = random.randrange(1 << 32)
+state = GameState(seed)
 clock = pygame.time.Clock()
-fall_time = 0
-fall_speed = 0.5  # seconds
+pacer = FramePacer(clock)
+timestep = FixedTimestep(60)
+recorder = Recorder(seed, 60)
+record_path = sys.argv[sys.argv.index('--record') + 1] if '--record' in sys.argv[:-1] else None
+replay_saved = False
+
+# A game in progress is checkpointed every few seconds and whenever the page
+# or window is hidden, so a tab switch or reload picks up where it left off
+SAVE_KEY = 'game'
+AUTOSAVE_INTERVAL = 5  # seconds of play
+autosave_time = 0
 
-# Key repeat settings
-pygame.key.set_repeat(200, 100)  # Delay, interval in milliseconds
+# High scores; each game over is ranked at once and written out in the background
+leaderboard = Leaderboard()
+final_rank = None
 
 async def main():
-    global current_tetromino, next_tetromino, fall_time, game_over, paused, score, level, lines_cleared
-    global width, height, BOARD_X, BOARD_Y, button_states
+    global show_ghost, show_hint, autoplay, autoplay_time, replay_saved, autosave_time, final_rank
+    
+    # Staged start: the board goes up straight away and the rest loads behind it
+    restore_game()
+    resize_display()
+    draw_first_frame()
+    await asyncio.sleep(0)
+    await load_assets()
+    asyncio.ensure_future(leaderboard.flush_forever())
     
     running = True
     while running:
-        # Calculate fall speed based on level
-        fall_speed = max(0.05, 0.5 - (level - 1) * 0.05)
+        if profiler:
+            profiler.frame()
         
-        dt = clock.tick(60) / 1000  # Convert to seconds
-        fall_time += dt
+        # Nothing on screen can change while paused or game over, once any
+        # effects have played out, so wait for input instead of ticking at full rate
+        idle = (state.paused or state.game_over) and not effects.active
+        dt = await pacer.tick(idle)
+        if profiler:
+            profiler.mark('wait')
+        
+        # A hidden tab or window pauses the game, which also drops it to idle pacing
+        if not state.game_over and not state.paused and page_hidden():
+            apply(PAUSE)
+            save_game()
+        
+        events = pygame.event.get()
+        if idle and not events:
+            continue
+        # Input is timed from when the batch was read, not from frame counts
+        now = pygame.time.get_ticks()
         
         # Event handling
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
+                save_game()
+                leaderboard.flush()
+            
+            elif event.type == pygame.VIDEORESIZE:
+                resize_display()
             
-            # Handle mouse/touch events for buttons
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                pos = pygame.mouse.get_pos()
-                for button_name, button_data in buttons.items():
-                    if button_data['rect'].collidepoint(pos):
-                        button_states[button_name] = True
-                        
-                        # Handle immediate button actions
-                        if button_data['action'] == 'P':
-                            paused = not paused
-                        elif button_data['action'] == 'R':
-                            if game_over:
-                                reset_game()
-                        elif button_data['action'] == 'ROTATE' and not game_over and not paused:
-                            current_tetromino.rotate()
+            elif event.type in (pygame.WINDOWHIDDEN, pygame.WINDOWMINIMIZED):
+                if not state.game_over and not state.paused:
+                    apply(PAUSE)
+                    save_game()
             
-            elif event.type == pygame.MOUSEBUTTONUP:
-                pos = pygame.mouse.get_pos()
-                for button_name, button_data in buttons.items():
-                    if button_data['rect'].collidepoint(pos) and button_states[button_name]:
-                        # Handle button release actions for certain buttons
-                        if button_data['action'] == 'SPACE' and not game_over and not paused:
-                            # Hard drop
-                            while current_tetromino.move(0, 1):
-                                pass
-                            
-                            lock_tetromino(current_tetromino)
-                            check_lines()
-                            current_tetromino = next_tetromino
-                            next_tetromino = create_new_tetromino()
-                            
-                            if not current_tetromino.is_valid_position():
-                                game_over = True
-                            
-                            fall_time = 0
-                
-                # Reset all button states on mouse up
-                for button_name in button_states:
-                    button_states[button_name] = False
+            # Every finger is tracked separately, so buttons can be held together
+            elif event.type == pygame.FINGERDOWN:
+                pointer_down((event.touch_id, event.finger_id), finger_pos(event), now)
+            elif event.type == pygame.FINGERMOTION:
+                pointer_move((event.touch_id, event.finger_id), finger_pos(event), now)
+            elif event.type == pygame.FINGERUP:
+                pointer_up((event.touch_id, event.finger_id), finger_pos(event))
             
-            if not game_over and not paused:
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_LEFT:
-                        current_tetromino.move(-1, 0)
-                    elif event.key == pygame.K_RIGHT:
-                        current_tetromino.move(1, 0)
-                    elif event.key == pygame.K_DOWN:
-                        current_tetromino.move(0, 1)
-                    elif event.key == pygame.K_UP:
-                        current_tetromino.rotate()
-                    elif event.key == pygame.K_SPACE:
-                        # Hard drop
-                        while current_tetromino.move(0, 1):
-                            pass
-                        
-                        lock_tetromino(current_tetromino)
-                        check_lines()
-                        current_tetromino = next_tetromino
-                        next_tetromino = create_new_tetromino()
-                        
-                        if not current_tetromino.is_valid_position():
-                            game_over = True
-                        
-                        fall_time = 0
+            # The mouse is one more pointer; SDL also mirrors touches as mouse
+            # events, and those are skipped since the finger events cover them
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and not getattr(event, 'touch', False):
+                pointer_down('mouse', to_logical(event.pos), now)
+            elif event.type == pygame.MOUSEMOTION and event.buttons[0] and not getattr(event, 'touch', False):
+                pointer_move('mouse', to_logical(event.pos), now)
+            elif event.type == pygame.MOUSEBUTTONUP and event.button == 1 and not getattr(event, 'touch', False):
+                pointer_up('mouse', to_logical(event.pos))
             
             if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_p:
-                    paused = not paused
-                elif event.key == pygame.K_r and game_over:
-                    reset_game()
-        
-        # Handle continuous button presses for movement
-        if not game_over and not paused:
-            if button_states['left']:
-                current_tetromino.move(-1, 0)
-            if button_states['right']:
-                current_tetromino.move(1, 0)
-            if button_states['down']:
-                current_tetromino.move(0, 1)
-                fall_time = 0
-        
-        # Game logic
-        if not game_over and not paused:
-            if fall_time >= fall_speed:
-                if not current_tetromino.move(0, 1):
-                    # Can't move down, lock the tetromino in place
-                    lock_tetromino(current_tetromino)
-                    check_lines()
-                    current_tetromino = next_tetromino
-                    next_tetromino = create_new_tetromino()
-                    
-                    if not current_tetromino.is_valid_position():
-                        game_over = True
-                
-                fall_time = 0
-        
-        # Clear the screen
-        screen.fill(BLACK)
+                if event.key in DIRECTION_KEYS:
+                    if not state.game_over and not state.paused:
+                        press_direction(DIRECTION_KEYS[event.key], now)
+                elif event.key == pygame.K_UP:
+                    apply(ROTATE)
+                elif event.key == pygame.K_SPACE:
+                    # Hard drop
+                    apply(HARD_DROP)
+                elif event.key == pygame.K_p:
+                    apply(PAUSE)
+                elif event.key == pygame.K_g:
+                    show_ghost = not show_ghost
+                elif event.key == pygame.K_h:
+                    show_hint = not show_hint
+                elif event.key == pygame.K_a:
+                    autoplay = not autoplay
+                    autoplay_time = 0
+                elif event.key == pygame.K_r:
+                    apply(RESTART)
+                elif event.key == pygame.K_F3:
+                    toggle_profiler()
+                elif event.key == pygame.K_F4 and profiler:
+                    os.makedirs(storage.SAVE_DIR, exist_ok=True)
+                    count = profiler.export(TRACE_PATH)
+                    print(f"Saved {count} trace events to {TRACE_PATH}")
+            
+            elif event.type == pygame.KEYUP and event.key in DIRECTION_KEYS:
+                repeat.release(DIRECTION_KEYS[event.key])
+        if profiler:
+            profiler.mark('events')
         
-        # Draw the game
-        draw_grid()
-        if not game_over and not paused:
-            current_tetromino.draw()
-        draw_score()
+        # Repeat held directions as their auto-shift timers come due
+        if not state.game_over and not state.paused:
+            for direction in repeat.due(now):
+                apply(DIRECTION_MOVES[direction])
+        else:
+            repeat.clear()
         
-        # Draw on-screen controls
-        draw_controls()
+        # In autoplay the bot places a piece every AUTOPLAY_INTERVAL
+        if autoplay and not state.game_over and not state.paused:
+            autoplay_time += dt
+            if autoplay_time >= AUTOPLAY_INTERVAL:
+                autoplay_time = 0
+                for action in bot.plan(state):
+                    apply(action)
+        if profiler:
+            profiler.mark('input')
         
-        # Draw game over or pause screen
-        if game_over:
-            draw_game_over()
-        elif paused:
-            draw_pause()
+        # Advance the simulation in fixed steps however long the frame took;
+        # a slow frame runs several steps and renders once
+        for _ in range(timestep.advance(dt)):
+            cleared = step(state, 0, timestep.step)
+            recorder.tick(state)
+            if cleared:
+                effects.line_clear(cleared)
+        effects.update(dt)
+        if profiler:
+            profiler.mark('logic')
         
-        # Update the display
-        pygame.display.flip()
+        # Score and keep the replay of each game as it ends, and checkpoint games in play
+        if state.game_over and not replay_saved:
+            replay_saved = True
+            final_rank = leaderboard.submit(state.score, state.lines_cleared, state.level)
+            save_game()
+            if record_path:
+                with open(record_path, 'wb') as f:
+                    f.write(recorder.finish(state).to_bytes())
+        elif not state.game_over:
+            replay_saved = False
+            if not state.paused:
+                autosave_time += dt
+                if autosave_time >= AUTOSAVE_INTERVAL:
+                    save_game()
         
-        # Required for Pygbag
-        await asyncio.sleep(0)
+        # Draw the game, repainting only what changed
+        draw_frame()
 
     # Quit Pygame
     pygame.quit()
     sys.exit()
 
-# Pygbag requires this structure
-asyncio.run(main())
+# Pygbag requires this structure. Pygbag runs this file as __main__; the guard
+# lets tools such as bench.py import the module without starting the game.
+if __name__ == '__main__':
+    asyncio.run(main())
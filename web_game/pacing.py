@@ -0,0 +1,71 @@
+import asyncio
+import sys
+
+import pygame
+
+# Milliseconds between checks for input while idling on the desktop
+IDLE_POLL_MS = 10
+
+# Events that end an idle wait: the ones the game loop acts on. peek() is
+# always given types, since without them it returns the first event itself
+# and drops the attributes of posted events along the way.
+WAKE_EVENTS = (pygame.QUIT, pygame.KEYDOWN, pygame.KEYUP,
+               pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEMOTION,
+               pygame.FINGERDOWN, pygame.FINGERUP, pygame.FINGERMOTION,
+               pygame.VIDEORESIZE, pygame.WINDOWHIDDEN, pygame.WINDOWMINIMIZED)
+
+
+class FramePacer:
+    # Ticks at full rate while the game is live. While the scene is static
+    # (paused, game over, hidden) it waits for input instead, waking at most
+    # idle_fps times a second, and resumes full rate as soon as input arrives.
+    def __init__(self, clock, fps=60, idle_fps=2):
+        self.clock = clock
+        self.fps = fps
+        self.idle_fps = idle_fps
+
+    async def tick(self, idle):
+        # Returns the seconds since the previous tick, or 0 after an idle wait
+        if not idle:
+            dt = self.clock.tick(self.fps)
+            # Required for Pygbag
+            await asyncio.sleep(0)
+            return dt / 1000
+
+        # Poll the queue without taking anything off it, so events reach the
+        # game loop in the order they happened (a press before its release)
+        deadline = pygame.time.get_ticks() + 1000 // self.idle_fps
+        while not pygame.event.peek(WAKE_EVENTS) and pygame.time.get_ticks() < deadline:
+            if sys.platform == 'emscripten':
+                # The browser loop can't block, so yield a frame at a time
+                await asyncio.sleep(1 / self.fps)
+            else:
+                # Sleep in SDL between polls, short enough not to delay input
+                pygame.time.wait(IDLE_POLL_MS)
+        await asyncio.sleep(0)
+        # Time spent idle never reaches the game: gravity, effects and timers
+        # resume where they stopped, and the clock restarts from the wake
+        self.clock.tick()
+        return 0.0
+
+
+class FixedTimestep:
+    # Turns variable frame times into a whole number of fixed logic steps, so the
+    # game plays the same at any frame rate. When a frame runs long the missing
+    # steps are caught up before the next render, up to max_steps; any backlog
+    # beyond that is dropped rather than letting catch-up snowball.
+    def __init__(self, rate=60, max_steps=5):
+        self.step = 1 / rate
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+
+    def advance(self, dt):
+        # Returns how many steps are due after dt more seconds
+        self.accumulator += dt
+        steps = int(self.accumulator / self.step)
+        if steps > self.max_steps:
+            steps = self.max_steps
+            self.accumulator = 0.0
+        else:
+            self.accumulator -= steps * self.step
+        return steps
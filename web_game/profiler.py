@@ -0,0 +1,112 @@
+# Opt-in frame profiler. The game loop calls frame() at the top of every
+# iteration and mark(phase) as each phase finishes; the time since the previous
+# mark is charged to that phase. Keeps rolling percentiles per phase, a
+# frame-time histogram and a bounded trace that can be saved in Chrome's trace
+# event format (open it in chrome://tracing or ui.perfetto.dev).
+#
+# When tracemalloc is running (python -X tracemalloc main.py --profile) it also
+# tracks the most memory each frame allocates on top of what it started with,
+# which stays near zero while the loop reuses its objects.
+import json
+import time
+import tracemalloc
+from collections import deque
+
+import pygame
+
+PHASES = ('wait', 'events', 'input', 'logic', 'board', 'compose', 'text', 'controls', 'present')
+
+# Upper bounds of the frame-time histogram buckets, in ms; the last bucket
+# holds everything slower
+HISTOGRAM_MS = (8, 12, 16.7, 20, 25, 33.3, 50)
+
+
+class FrameProfiler:
+    def __init__(self, window=300, trace_frames=1800):
+        self.clock = time.perf_counter_ns
+        # Timing starts now, so marks made before the first frame() still count
+        self.frame_start = self.last = self.clock()
+        self.current = dict.fromkeys(PHASES, 0)  # ns spent in each phase this frame
+        self.history = {name: deque(maxlen=window) for name in PHASES + ('frame', 'alloc')}
+        self.histogram = [0] * (len(HISTOGRAM_MS) + 1)
+        self.trace = deque(maxlen=trace_frames * (len(PHASES) + 1))  # (name, start_ns, duration_ns)
+        self.frames = 0
+        self.alloc_start = 0
+
+    def frame(self):
+        # Close the previous frame and start timing a new one
+        now = self.clock()
+        total = now - self.frame_start
+        current = self.current
+        for phase in PHASES:
+            self.history[phase].append(current[phase])
+            current[phase] = 0
+        self.history['frame'].append(total)
+        bucket = 0
+        while bucket < len(HISTOGRAM_MS) and total > HISTOGRAM_MS[bucket] * 1e6:
+            bucket += 1
+        self.histogram[bucket] += 1
+        self.trace.append(('frame', self.frame_start, total))
+        if tracemalloc.is_tracing():
+            # Bytes allocated at the frame's peak beyond what was in use at its start
+            start = self.alloc_start
+            self.alloc_start, peak = tracemalloc.get_traced_memory()
+            if self.frames:
+                self.history['alloc'].append(max(0, peak - start))
+            tracemalloc.reset_peak()
+        self.frames += 1
+        self.frame_start = self.last = now
+
+    def mark(self, phase):
+        now = self.clock()
+        duration = now - self.last
+        self.current[phase] += duration
+        self.trace.append((phase, self.last, duration))
+        self.last = now
+
+    def percentiles(self, name, unit=1e6):
+        # (p50, p95, p99) over the rolling window, in ms by default
+        values = sorted(self.history[name])
+        if not values:
+            return (0.0, 0.0, 0.0)
+        last = len(values) - 1
+        return tuple(values[round(last * p)] / unit for p in (0.5, 0.95, 0.99))
+
+    def export(self, path):
+        # Phases are complete events nested inside their frame on one thread
+        events = [{'name': name, 'cat': 'frame' if name == 'frame' else 'phase', 'ph': 'X',
+                   'ts': start / 1000, 'dur': duration / 1000, 'pid': 1, 'tid': 1}
+                  for name, start, duration in self.trace]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+    def render_hud(self, font, color=(255, 255, 255), background=(0, 0, 0, 170)):
+        # Percentile table and histogram as one translucent surface
+        lines = [f"{'ms':<9}{'p50':>6}{'p95':>6}{'p99':>6}"]
+        for name in ('frame',) + PHASES:
+            p50, p95, p99 = self.percentiles(name)
+            lines.append(f"{name:<9}{p50:>6.1f}{p95:>6.1f}{p99:>6.1f}")
+        if self.history['alloc']:
+            p50, p95, p99 = self.percentiles('alloc', 1e3)
+            lines.append(f"{'alloc KB':<9}{p50:>6.1f}{p95:>6.1f}{p99:>6.1f}")
+        texts = [font.render(line, True, color) for line in lines]
+
+        line_height = font.get_linesize()
+        bar_width = 120
+        labels = [f"<{bound:g}" for bound in HISTOGRAM_MS] + [f">{HISTOGRAM_MS[-1]:g}"]
+        width = max(max(text.get_width() for text in texts), 40 + bar_width) + 10
+        height = line_height * (len(texts) + len(labels)) + 15
+        surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        surface.fill(background)
+        y = 5
+        for text in texts:
+            surface.blit(text, (5, y))
+            y += line_height
+        y += 5
+        most = max(self.histogram) or 1
+        for label, count in zip(labels, self.histogram):
+            surface.blit(font.render(label, True, color), (5, y))
+            pygame.draw.rect(surface, color, (45, y + 3, max(1, bar_width * count // most), line_height - 6))
+            y += line_height
+        return surface
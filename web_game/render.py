@@ -0,0 +1,228 @@
+from collections import OrderedDict
+
+import pygame
+
+from engine import GRID_WIDTH, GRID_HEIGHT, ALL_ROWS
+
+# Added to a colour index to mark a ghost-piece cell in an overlay
+GHOST = 8
+
+# Overlay code for cells of a suggested placement
+HINT = 16
+
+CELL_COUNT = GRID_WIDTH * GRID_HEIGHT
+
+# Most cells an overlay can hold: the falling piece, its ghost and a hint
+MAX_OVERLAY = 12
+
+# Column and row of each cell, by index y * GRID_WIDTH + x
+CELL_COLUMN = [i % GRID_WIDTH for i in range(CELL_COUNT)]
+CELL_ROW = [i // GRID_WIDTH for i in range(CELL_COUNT)]
+
+# The cell indices of each row
+ROW_CELLS = [list(range(y * GRID_WIDTH, (y + 1) * GRID_WIDTH)) for y in range(GRID_HEIGHT)]
+
+
+def shade(color, amount):
+    # Lighten (amount > 0) or darken (amount < 0) a colour towards white or black
+    if amount >= 0:
+        return tuple(c + (255 - c) * amount // 100 for c in color)
+    return tuple(c * (100 + amount) // 100 for c in color)
+
+
+def build_block_atlas(colors, cell_size, empty_color, hint_color=(255, 255, 255)):
+    # One row of tiles indexed by cell code: the empty tile, a bevelled block per
+    # colour, a ghost outline per colour and the hint marker. Returns the surface
+    # and tile areas.
+    tiles = [None] * (HINT + 1)
+    codes = [0] + [i + 1 for i in range(len(colors))] + [GHOST + i + 1 for i in range(len(colors))] + [HINT]
+    atlas = pygame.Surface((cell_size * len(codes), cell_size))
+    atlas.fill(empty_color)
+    bevel = max(2, cell_size // 8)
+    for slot, code in enumerate(codes):
+        area = pygame.Rect(slot * cell_size, 0, cell_size, cell_size)
+        tiles[code] = area
+        if code == 0:
+            continue
+        if code == HINT:
+            pygame.draw.rect(atlas, hint_color, area.inflate(-6, -6), 3)
+            continue
+        if code > GHOST:
+            pygame.draw.rect(atlas, colors[code - GHOST - 1], area, 2)
+            continue
+        color = colors[code - 1]
+        atlas.fill(shade(color, -35), area)
+        atlas.fill(shade(color, 45), (area.x, area.y, cell_size - bevel, cell_size - bevel))
+        atlas.fill(color, area.inflate(-2 * bevel, -2 * bevel))
+    return atlas, tiles
+
+
+class Overlay:
+    # Cell codes drawn over the board for one frame: the falling piece, its
+    # ghost and a hint. codes holds a code per cell index (0 where nothing is
+    # set) and cells the indices set so far, so filling and clearing an overlay
+    # every frame creates no objects.
+    def __init__(self):
+        self.codes = [0] * CELL_COUNT
+        self.cells = [0] * MAX_OVERLAY
+        self.count = 0
+
+    def set(self, x, y, code):
+        i = y * GRID_WIDTH + x
+        if not self.codes[i]:
+            self.cells[self.count] = i
+            self.count += 1
+        self.codes[i] = code
+
+    def clear(self):
+        codes = self.codes
+        cells = self.cells
+        for k in range(self.count):
+            codes[cells[k]] = 0
+        self.count = 0
+
+
+class BoardRenderer:
+    # Retained-mode board: the board is kept drawn on its own surface and only
+    # cells whose contents changed since the last frame are repainted. Every
+    # table, rect and blit entry a repaint needs is built here, so an update()
+    # with nothing to repaint allocates nothing, and one that repaints only
+    # the list it batches the blits in.
+    def __init__(self, colors, cell_size, margin, background, empty_color):
+        self.cell_size = cell_size
+        self.margin = margin
+        self.pitch = cell_size + margin
+        self.atlas, self.tiles = build_block_atlas(colors, cell_size, empty_color)
+        self.surface = pygame.Surface((GRID_WIDTH * self.pitch + margin, GRID_HEIGHT * self.pitch + margin))
+        self.surface.fill(background)
+        # What is currently painted in each cell (-1 forces a repaint), and
+        # whether the next update() checks every row, not just the dirty ones
+        self.shown = [-1] * CELL_COUNT
+        self.repaint_all = True
+        # The overlay update() draws next, and the cells the last one covered
+        self.overlay = Overlay()
+        self.covered = [0] * MAX_OVERLAY
+        self.covered_count = 0
+
+        # Pixel position of each column and row, and the blits() entry that
+        # paints each cell with each code
+        self.column_x = [margin + x * self.pitch for x in range(GRID_WIDTH)]
+        self.row_y = [margin + y * self.pitch for y in range(GRID_HEIGHT)]
+        self.items = []
+        for i in range(CELL_COUNT):
+            position = (self.column_x[CELL_COLUMN[i]], self.row_y[CELL_ROW[i]])
+            self.items.append([None if tile is None else (self.atlas, position, tile) for tile in self.tiles])
+
+        # Cells to check, the repainted span of each row (left > right when
+        # none), and a rect per row to report it with
+        self.candidates = [0] * (CELL_COUNT + 2 * MAX_OVERLAY)
+        self.span_left = [GRID_WIDTH] * GRID_HEIGHT
+        self.span_right = [-1] * GRID_HEIGHT
+        self.row_rects = [pygame.Rect(0, 0, 0, cell_size) for _ in range(GRID_HEIGHT)]
+        self.batch = []
+
+    def invalidate(self):
+        self.shown[:] = [-1] * CELL_COUNT
+        self.repaint_all = True
+
+    def update(self, board, dirty=None, left=0, top=0):
+        # Paints self.overlay over the board, then empties it for the next frame.
+        # Checks only rows the board marked dirty (every row after invalidate())
+        # plus cells the overlay covers now or covered last frame. Each repainted row's span is appended to
+        # dirty as a rect offset by (left, top); the rects are reused by the
+        # next update().
+        overlay = self.overlay
+        codes = overlay.codes
+        cells = board.cells
+        shown = self.shown
+        items = self.items
+        span_left = self.span_left
+        span_right = self.span_right
+        batch = self.batch
+
+        candidates = self.candidates
+        count = 0
+        dirty_rows = board.dirty
+        board.dirty = 0
+        if self.repaint_all:
+            dirty_rows = ALL_ROWS
+            self.repaint_all = False
+        if dirty_rows:
+            for y in range(GRID_HEIGHT):
+                if dirty_rows >> y & 1:
+                    candidates[count:count + GRID_WIDTH] = ROW_CELLS[y]
+                    count += GRID_WIDTH
+        for k in range(self.covered_count):
+            candidates[count] = self.covered[k]
+            count += 1
+        for k in range(overlay.count):
+            candidates[count] = self.covered[k] = overlay.cells[k]
+            count += 1
+        self.covered_count = overlay.count
+
+        for k in range(count):
+            i = candidates[k]
+            y = CELL_ROW[i]
+            x = CELL_COLUMN[i]
+            code = codes[i] or cells[y][x]
+            if shown[i] != code:
+                shown[i] = code
+                # Every changed cell is copied from the atlas in one blits() call
+                batch.append(items[i][code])
+                if x < span_left[y]:
+                    span_left[y] = x
+                if x > span_right[y]:
+                    span_right[y] = x
+        overlay.clear()
+        if not batch:
+            return
+        self.surface.blits(batch, False)
+        batch.clear()
+
+        pitch = self.pitch
+        for y in range(GRID_HEIGHT):
+            if span_right[y] >= 0:
+                if dirty is not None:
+                    rect = self.row_rects[y]
+                    rect.update(left + self.column_x[span_left[y]], top + self.row_y[y],
+                                (span_right[y] - span_left[y]) * pitch + self.cell_size, self.cell_size)
+                    dirty.append(rect)
+                span_left[y] = GRID_WIDTH
+                span_right[y] = -1
+
+
+class TextCache:
+    # Rendered text surfaces keyed by font, string, colour and antialias.
+    # Least recently used entries are evicted once capacity is reached.
+    def __init__(self, capacity=128):
+        self.capacity = capacity
+        self.surfaces = OrderedDict()
+
+    def render(self, font, text, antialias, color):
+        key = (font, text, color, antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+        surface = font.render(text, antialias, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.capacity:
+            self.surfaces.popitem(last=False)
+        return surface
+
+
+class LayerCache:
+    # Static layers rendered once by build(key) and blitted every frame after.
+    # Nothing is rebuilt until invalidate() is called, e.g. after a layout change.
+    def __init__(self, build):
+        self.build = build
+        self.layers = {}
+
+    def get(self, key):
+        layer = self.layers.get(key)
+        if layer is None:
+            layer = self.layers[key] = self.build(key)
+        return layer
+
+    def invalidate(self):
+        self.layers.clear()
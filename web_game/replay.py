@@ -0,0 +1,272 @@
+# Deterministic replays. A game is fully described by its piece seed and the
+# input actions applied between fixed logic steps, so a replay stores just the
+# seed, a tick-stamped action log and periodic state checksums. The verifier
+# re-simulates a replay headlessly, without rendering or frame pacing, and
+# reports the first checkpoint where the simulation disagrees with the log.
+#
+#   python replay.py game.replay ...
+import struct
+import sys
+import time
+import zlib
+
+from engine import GRID_HEIGHT
+from game import GameState, step, fall_speed, lock_and_spawn
+
+MAGIC = b'TRPL'
+VERSION = 1
+
+# Ticks between state checksums in a recording
+CHECKPOINT_TICKS = 30
+
+STATE_FORMAT = struct.Struct(f'<{GRID_HEIGHT}H7i')
+
+
+def checksum(state):
+    # CRC of everything that decides how the game continues
+    piece = state.current
+    return zlib.crc32(STATE_FORMAT.pack(*state.board.rows, state.score, state.lines_cleared, state.level,
+                                        state.pieces_placed, piece.shape_index * 4 + piece.rotation, piece.x, piece.y))
+
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError('replay ends part way through')
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class Replay:
+    __slots__ = ('seed', 'rate', 'ticks', 'inputs', 'checkpoints', 'score', 'lines', 'level')
+
+    def __init__(self, seed, rate):
+        self.seed = seed
+        self.rate = rate
+        self.ticks = 0
+        self.inputs = []  # (tick, actions), in the order they were applied
+        self.checkpoints = []  # (tick, checksum) taken right after that tick's step
+        self.score = 0
+        self.lines = 0
+        self.level = 1
+
+    def to_bytes(self):
+        # Varints throughout; ticks are stored as deltas, so a typical entry is two bytes
+        out = bytearray(MAGIC)
+        out.append(VERSION)
+        for value in (self.seed, self.rate, self.ticks, self.score, self.lines, self.level, len(self.inputs)):
+            write_varint(out, value)
+        last = 0
+        for tick, actions in self.inputs:
+            write_varint(out, tick - last)
+            out.append(actions)
+            last = tick
+        write_varint(out, len(self.checkpoints))
+        last = 0
+        for tick, crc in self.checkpoints:
+            write_varint(out, tick - last)
+            out += crc.to_bytes(4, 'little')
+            last = tick
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        # Replays come from clients, so anything malformed is a ValueError
+        if len(data) < 5 or data[:4] != MAGIC or data[4] != VERSION:
+            raise ValueError('not a replay, or an unsupported version')
+        offset = 5
+        values = []
+        for _ in range(7):
+            value, offset = read_varint(data, offset)
+            values.append(value)
+        seed, rate, ticks, score, lines, level, count = values
+        if rate == 0:
+            raise ValueError('replay has no tick rate')
+        replay = cls(seed, rate)
+        replay.ticks = ticks
+        replay.score = score
+        replay.lines = lines
+        replay.level = level
+        tick = 0
+        for _ in range(count):
+            delta, offset = read_varint(data, offset)
+            tick += delta
+            if offset >= len(data):
+                raise ValueError('replay ends part way through')
+            replay.inputs.append((tick, data[offset]))
+            offset += 1
+        count, offset = read_varint(data, offset)
+        tick = 0
+        for _ in range(count):
+            delta, offset = read_varint(data, offset)
+            tick += delta
+            if offset + 4 > len(data):
+                raise ValueError('replay ends part way through')
+            replay.checkpoints.append((tick, int.from_bytes(data[offset:offset + 4], 'little')))
+            offset += 4
+        return replay
+
+
+class Recorder:
+    # Builds a Replay alongside a live game. The game must be stepped only
+    # through record() for inputs and tick() after each fixed step.
+    def __init__(self, seed, rate):
+        self.replay = Replay(seed, rate)
+
+    def record(self, actions):
+        self.replay.inputs.append((self.replay.ticks, actions))
+
+    def tick(self, state):
+        replay = self.replay
+        replay.ticks += 1
+        if replay.ticks % CHECKPOINT_TICKS == 0:
+            replay.checkpoints.append((replay.ticks, checksum(state)))
+
+    def finish(self, state):
+        # The replay so far, stamped with the current result
+        replay = self.replay
+        replay.score = state.score
+        replay.lines = state.lines_cleared
+        replay.level = state.level
+        return replay
+
+
+class Gravity:
+    # Gravity during fixed steps only ever adds dt to a fall timer that starts
+    # at zero, so the timer is always one of a few exact float sums and the tick
+    # of the next fall can be looked up instead of stepped towards.
+    def __init__(self, dt):
+        self.dt = dt
+        self.sums = [0]
+        while self.sums[-1] < fall_speed(1):
+            self.sums.append(self.sums[-1] + dt)
+        self.index = {value: k for k, value in enumerate(self.sums)}
+        self.periods = {}
+
+    def period(self, level):
+        # Ticks from a reset timer to the next fall at this level
+        period = self.periods.get(level)
+        if period is None:
+            speed = fall_speed(level)
+            period = self.periods[level] = next(k for k, value in enumerate(self.sums) if value >= speed)
+        return period
+
+    def advance(self, state, ticks):
+        # Same result as calling step(state, 0, dt) ticks times
+        while ticks > 0 and not state.game_over and not state.paused:
+            k = self.index.get(state.fall_time)
+            if k is None:
+                # Timer was driven by some other dt; fall back to plain steps
+                for _ in range(ticks):
+                    step(state, 0, self.dt)
+                return
+            period = self.period(state.level)
+            until = max(1, period - k)
+            if ticks < until:
+                state.fall_time = self.sums[k + ticks]
+                return
+
+            # The piece falls once at `until` and then every period; it drops
+            # freely until it rests, and the fall after that locks it
+            falls = 1 + (ticks - until) // period
+            piece = state.current
+            distance = piece.drop_distance(state.board)
+            state.fall_time = 0
+            if falls <= distance:
+                piece.y += falls
+                ticks -= until + (falls - 1) * period
+            else:
+                piece.y += distance
+                ticks -= until + distance * period
+                lock_and_spawn(state)
+
+
+class Result:
+    __slots__ = ('ok', 'divergent_tick', 'score', 'lines', 'level')
+
+    def __init__(self, ok, divergent_tick, state):
+        self.ok = ok
+        self.divergent_tick = divergent_tick
+        self.score = state.score
+        self.lines = state.lines_cleared
+        self.level = state.level
+
+
+_gravity = {}
+
+
+def verify(replay):
+    # Re-simulate a replay and compare it with its checkpoints and result.
+    # divergent_tick is the first checkpoint that didn't match, or the final
+    # tick when only the result is wrong.
+    if isinstance(replay, (bytes, bytearray)):
+        replay = Replay.from_bytes(replay)
+    gravity = _gravity.get(replay.rate)
+    if gravity is None:
+        gravity = _gravity[replay.rate] = Gravity(1 / replay.rate)
+
+    state = GameState(replay.seed)
+    tick = 0
+    inputs = replay.inputs
+    checkpoints = replay.checkpoints
+    i = j = 0
+    while True:
+        # Checkpoints at a tick come before that tick's inputs
+        if j < len(checkpoints) and (i == len(inputs) or checkpoints[j][0] <= inputs[i][0]):
+            target, crc = checkpoints[j]
+            gravity.advance(state, target - tick)
+            tick = target
+            if checksum(state) != crc:
+                return Result(False, tick, state)
+            j += 1
+        elif i < len(inputs):
+            target, actions = inputs[i]
+            gravity.advance(state, target - tick)
+            tick = target
+            step(state, actions, 0)
+            i += 1
+        else:
+            break
+    gravity.advance(state, replay.ticks - tick)
+
+    ok = (state.score, state.lines_cleared, state.level) == (replay.score, replay.lines, replay.level)
+    return Result(ok, None if ok else replay.ticks, state)
+
+
+def main(paths):
+    failed = 0
+    start = time.perf_counter()
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            result = verify(data)
+        except ValueError as error:
+            failed += 1
+            print(f"{path}: invalid, {error}")
+            continue
+        if result.ok:
+            print(f"{path}: ok, score {result.score}, lines {result.lines}, level {result.level}")
+        else:
+            failed += 1
+            print(f"{path}: diverged at tick {result.divergent_tick}")
+    elapsed = time.perf_counter() - start
+    print(f"{len(paths)} replays in {elapsed:.3f}s, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,77 @@
+# High scores. Every finished game is appended to a log of fixed-size records
+# in storage, while memory holds only the best TOP_K, sorted, so a game's rank
+# and the best score are known the moment it ends. New records wait in a
+# queue that flush_forever() writes behind the game from the asyncio loop, a
+# batch at a time; once the log reaches COMPACT_AT records it is rewritten
+# with just the top TOP_K, which bounds it however many games are played.
+import asyncio
+import bisect
+import struct
+import time
+
+import storage
+
+RECORD = struct.Struct('<IIHI')  # score, lines, level, finished (unix time)
+
+TOP_K = 100
+COMPACT_AT = 1000
+
+# Seconds between writes of the queued records
+FLUSH_INTERVAL = 2
+
+
+def rank_key(entry):
+    # Highest score first; equal scores keep the order they were set in
+    return (-entry[0], entry[3])
+
+
+class Leaderboard:
+    def __init__(self, key='scores'):
+        self.key = key
+        self.top = []  # (score, lines, level, finished), best first
+        self.pending = bytearray()
+        self.logged = 0  # records in the stored log
+
+    def load(self):
+        data = storage.read(self.key) or b''
+        count = len(data) // RECORD.size
+        if len(data) % RECORD.size:
+            # A write cut short left part of a record; drop it so appends stay aligned
+            storage.write(self.key, data[:count * RECORD.size])
+        entries = sorted(RECORD.iter_unpack(data[:count * RECORD.size]), key=rank_key)
+        self.top = entries[:TOP_K]
+        self.logged = count
+
+    def submit(self, score, lines, level):
+        # Records a finished game and returns its rank among the best TOP_K
+        # (1 is the best), or None if it didn't make it
+        entry = (score, lines, level, int(time.time()))
+        self.pending += RECORD.pack(*entry)
+        index = bisect.bisect_right(self.top, rank_key(entry), key=rank_key)
+        if index >= TOP_K:
+            return None
+        self.top.insert(index, entry)
+        del self.top[TOP_K:]
+        return index + 1
+
+    def best(self):
+        return self.top[0][0] if self.top else 0
+
+    def flush(self):
+        # Write the queued records in one go, compacting the log when it's due
+        if not self.pending:
+            return
+        count = len(self.pending) // RECORD.size
+        if self.logged + count >= COMPACT_AT:
+            # The top TOP_K already includes any queued record good enough to keep
+            storage.write(self.key, b''.join(RECORD.pack(*entry) for entry in self.top))
+            self.logged = len(self.top)
+        else:
+            storage.append(self.key, bytes(self.pending))
+            self.logged += count
+        self.pending.clear()
+
+    async def flush_forever(self, interval=FLUSH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
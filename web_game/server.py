@@ -0,0 +1,301 @@
+# Authoritative game server. Every connected player gets a board in one
+# BatchGame, and a single timer advances all of them together each tick, so
+# the cost per tick is a handful of NumPy operations rather than a coroutine
+# per player. After each tick only what changed is sent: rows, the piece,
+# the next piece, score/lines/level and the play state.
+#
+# Protocol, one message per line over TCP:
+#   client -> server: action flags as a decimal integer (game.MOVE_LEFT | ...)
+#   server -> client: JSON, first {"session", "seed"} and then deltas such as
+#     {"tick": 812, "rows": [[19, 1023]], "piece": [shape, rotation, x, y],
+#      "next": 3, "score": 100, "lines": 1, "level": 1, "state": "playing"}
+#
+#   python server.py --port 8765
+#   python server.py --fake-clients 2000 --seconds 20
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from collections import deque
+
+import numpy as np
+
+from engine import GRID_HEIGHT
+from game import MOVE_LEFT, MOVE_RIGHT, SOFT_DROP, ROTATE, HARD_DROP, PAUSE, RESTART
+from batch import BatchGame
+
+ALL_ACTIONS = MOVE_LEFT | MOVE_RIGHT | SOFT_DROP | ROTATE | HARD_DROP | PAUSE | RESTART
+
+# Inputs applied per session per tick; any more wait for the next tick
+MAX_INPUTS_PER_TICK = 4
+# Inputs a session may have queued before further ones are dropped
+MAX_QUEUED_INPUTS = 64
+# Clients with this much unsent output are skipped until they catch up; their
+# next delta then covers everything they missed
+MAX_WRITE_BUFFER = 64 * 1024
+
+STATE_NAMES = ('playing', 'paused', 'over')
+
+
+class Session(asyncio.Protocol):
+    # One client connection. Input is parsed in data_received and queued for
+    # the next tick; the server writes deltas to the transport directly.
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.slot = None
+        self.id = None
+        self.buffer = b''
+        self.inputs = deque()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.join(self)
+
+    def connection_lost(self, exc):
+        self.server.leave(self)
+
+    def data_received(self, data):
+        lines = (self.buffer + data).split(b'\n')
+        self.buffer = lines.pop()
+        for line in lines:
+            try:
+                actions = int(line)
+            except ValueError:
+                self.transport.close()
+                return
+            if len(self.inputs) < MAX_QUEUED_INPUTS:
+                self.inputs.append(actions & ALL_ACTIONS)
+        if len(self.buffer) > 64:
+            self.transport.close()
+
+    def send(self, message):
+        self.transport.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+
+
+class GameServer:
+    def __init__(self, rate=60, capacity=256):
+        self.rate = rate
+        self.interval = 1 / rate
+        self.games = BatchGame([None] * capacity)
+        # Free boards are parked in the game-over state, where step() leaves them alone
+        self.games.game_over[:] = True
+        self.free = list(range(capacity - 1, -1, -1))
+        self.sessions = {}  # slot -> Session
+        self.next_id = 0
+        self.tick = 0
+        # What each client was last sent; -1 never matches, forcing a full send
+        self.sent_rows = np.full((capacity, GRID_HEIGHT), -1, dtype=np.int64)
+        self.sent_values = np.full((capacity, 9), -1, dtype=np.int64)
+        self.tick_times = deque(maxlen=1000)
+        self.overruns = 0
+
+    def join(self, session):
+        if not self.free:
+            self.grow(self.games.count * 2)
+        slot = self.free.pop()
+        seed = random.randrange(1 << 32)
+        self.games.start(slot, seed)
+        self.sent_rows[slot] = -1
+        self.sent_values[slot] = -1
+        session.slot = slot
+        session.id = self.next_id
+        self.next_id += 1
+        self.sessions[slot] = session
+        session.send({'session': session.id, 'seed': seed})
+
+    def leave(self, session):
+        if self.sessions.get(session.slot) is session:
+            del self.sessions[session.slot]
+            self.games.game_over[session.slot] = True
+            self.free.append(session.slot)
+
+    def grow(self, capacity):
+        old = self.games.count
+        self.games.grow(capacity)
+        self.games.game_over[old:] = True
+        self.free.extend(range(capacity - 1, old - 1, -1))
+        self.sent_rows = np.concatenate([self.sent_rows, np.full((capacity - old, GRID_HEIGHT), -1, dtype=np.int64)])
+        self.sent_values = np.concatenate([self.sent_values, np.full((capacity - old, 9), -1, dtype=np.int64)])
+
+    def step(self):
+        # One tick for every session: queued inputs as zero-length steps, in
+        # the order they arrived, then one step of gravity
+        games = self.games
+        queued = [session for session in self.sessions.values() if session.inputs]
+        rounds = min(MAX_INPUTS_PER_TICK, max((len(session.inputs) for session in queued), default=0))
+        for _ in range(rounds):
+            actions = np.zeros(games.count, dtype=np.int64)
+            for session in queued:
+                if session.inputs:
+                    actions[session.slot] = session.inputs.popleft()
+            games.step(actions, 0)
+        games.step(np.zeros(games.count, dtype=np.int64), self.interval)
+        self.tick += 1
+        self.send_deltas()
+
+    def send_deltas(self):
+        games = self.games
+        state = np.where(games.game_over, 2, np.where(games.paused, 1, 0))
+        values = np.stack([games.shape, games.rotation, games.x, games.y, games.next_shape,
+                           games.score, games.lines_cleared, games.level, state], axis=1)
+        rows_changed = games.rows != self.sent_rows
+        values_changed = values != self.sent_values
+        changed = rows_changed.any(axis=1) | values_changed.any(axis=1)
+
+        sessions = self.sessions
+        for slot in np.flatnonzero(changed).tolist():
+            session = sessions.get(slot)
+            if session is None or session.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+                changed[slot] = False
+                continue
+            message = {'tick': self.tick}
+            ys = np.flatnonzero(rows_changed[slot])
+            if len(ys):
+                message['rows'] = list(zip(ys.tolist(), games.rows[slot, ys].tolist()))
+            new, old = values[slot].tolist(), self.sent_values[slot].tolist()
+            if new[:4] != old[:4]:
+                message['piece'] = new[:4]
+            for key, i in (('next', 4), ('score', 5), ('lines', 6), ('level', 7)):
+                if new[i] != old[i]:
+                    message[key] = new[i]
+            if new[8] != old[8]:
+                message['state'] = STATE_NAMES[new[8]]
+            session.send(message)
+
+        self.sent_rows[changed] = games.rows[changed]
+        self.sent_values[changed] = values[changed]
+
+    async def run(self):
+        # Ticks are scheduled against deadlines; a tick that overruns its slot
+        # drops the backlog instead of bunching several ticks together
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            start = time.perf_counter()
+            self.step()
+            self.tick_times.append(time.perf_counter() - start)
+            deadline += self.interval
+            delay = deadline - loop.time()
+            if delay < 0:
+                self.overruns += 1
+                deadline = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        times = sorted(self.tick_times) or [0]
+        return (f"{len(self.sessions)} sessions, tick {self.tick}, "
+                f"tick time p50 {statistics.median(times) * 1000:.2f}ms "
+                f"p99 {times[int(len(times) * 0.99)] * 1000:.2f}ms max {times[-1] * 1000:.2f}ms, "
+                f"{self.overruns} overruns")
+
+
+class FakeClient:
+    # Test client: mirrors its game from the deltas and sends random input
+    def __init__(self, rng):
+        self.rng = rng
+        self.session = None
+        self.rows = [0] * GRID_HEIGHT
+        self.values = {}
+        self.messages = 0
+        self.receiving = None
+
+    async def run(self, host, port, stop, inputs_per_second=8):
+        reader, writer = await asyncio.open_connection(host, port)
+        self.receiving = asyncio.ensure_future(self.receive(reader))
+        actions = (MOVE_LEFT, MOVE_RIGHT, SOFT_DROP, ROTATE, HARD_DROP, RESTART)
+        while not stop.is_set():
+            await asyncio.sleep(self.rng.expovariate(inputs_per_second))
+            writer.write(b'%d\n' % self.rng.choice(actions))
+        return writer
+
+    async def receive(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            self.messages += 1
+            if 'session' in message:
+                self.session = message['session']
+            for y, row in message.get('rows', ()):
+                self.rows[y] = row
+            for key in ('piece', 'next', 'score', 'lines', 'level', 'state'):
+                if key in message:
+                    self.values[key] = message[key]
+
+
+async def fake_load(count, seconds, port):
+    # Run the server with count local fake clients, then check that every
+    # client's mirrored game matches the server's copy
+    server = GameServer()
+    loop = asyncio.get_running_loop()
+    listener = await loop.create_server(lambda: Session(server), '127.0.0.1', port)
+    port = listener.sockets[0].getsockname()[1]
+    ticker = asyncio.ensure_future(server.run())
+
+    stop = asyncio.Event()
+    clients = [FakeClient(random.Random(i)) for i in range(count)]
+    runs = [asyncio.ensure_future(client.run('127.0.0.1', port, stop)) for client in clients]
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        await asyncio.sleep(5)
+        print(server.stats())
+        server.tick_times.clear()
+    stop.set()
+    writers = await asyncio.gather(*runs)
+    # Let the last inputs play out, then stop the clock and let the final deltas arrive
+    await asyncio.sleep(0.5)
+    ticker.cancel()
+    await asyncio.sleep(0.5)
+    for client in clients:
+        client.receiving.cancel()
+
+    by_id = {session.id: session for session in server.sessions.values()}
+    games = server.games
+    mismatched = 0
+    for client in clients:
+        slot = by_id[client.session].slot
+        expected = [games.shape[slot], games.rotation[slot], games.x[slot], games.y[slot]]
+        if client.rows != games.rows[slot].tolist() or client.values['piece'] != expected or client.values['score'] != games.score[slot]:
+            mismatched += 1
+    messages = sum(client.messages for client in clients)
+    print(f"{count} clients, {messages} messages, {mismatched} mirrors out of step")
+
+    for writer in writers:
+        writer.close()
+    listener.close()
+    return mismatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve headless games over TCP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rate', type=int, default=60, help='ticks per second')
+    parser.add_argument('--fake-clients', type=int, help='run this many local test clients and check their mirrors')
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    if args.fake_clients:
+        mismatched = asyncio.run(fake_load(args.fake_clients, args.seconds, 0))
+        raise SystemExit(1 if mismatched else 0)
+
+    async def serve():
+        server = GameServer(args.rate)
+        listener = await asyncio.get_running_loop().create_server(lambda: Session(server), args.host, args.port)
+        print(f"serving on {args.host}:{args.port} at {args.rate} ticks/s")
+        asyncio.ensure_future(server.run())
+        async with listener:
+            while True:
+                await asyncio.sleep(10)
+                print(server.stats())
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# Compact, versioned snapshots of a GameState: enough to carry on a game
+# exactly where it was, after a tab switch or a page reload, and small enough
+# to ship boards in bulk to analysis tools. A snapshot is a fixed-size record,
+# optionally followed by the piece generator's state, so a file of them can be
+# split by size alone.
+#
+# Layout, little-endian:
+#   magic 'TSNP', version, flags
+#   GRID_HEIGHT rows, each its cells' colour indices at 3 bits per cell
+#   current piece (shape, rotation, x, y), next piece (the same)
+#   score, level, lines cleared, pieces placed, fall timer
+#   with HAS_RNG: the 624 Mersenne Twister words and the position within them
+import random
+import struct
+
+from engine import GRID_WIDTH, GRID_HEIGHT, PIECES, Board
+from game import GameState, Tetromino
+
+MAGIC = b'TSNP'
+VERSION = 1
+
+# Flags
+PAUSED = 1
+GAME_OVER = 2
+HAS_RNG = 4
+
+CELL_BITS = 3
+CELL_MASK = (1 << CELL_BITS) - 1
+
+RECORD = struct.Struct(f'<4sBB{GRID_HEIGHT}I8bIHIId')
+RNG = struct.Struct('<625I')
+
+# Bytes per snapshot, without and with the generator state
+SIZE = RECORD.size
+RNG_SIZE = RECORD.size + RNG.size
+
+
+def dumps(state, rng=True):
+    # Snapshots for analysis can leave out the generator, which is most of the size
+    flags = (PAUSED if state.paused else 0) | (GAME_OVER if state.game_over else 0) | (HAS_RNG if rng else 0)
+    rows = state.board.rows
+    cells = state.board.cells
+    packed = [0] * GRID_HEIGHT
+    for y in range(GRID_HEIGHT):
+        if rows[y]:
+            value = 0
+            for x, cell in enumerate(cells[y]):
+                value |= cell << (x * CELL_BITS)
+            packed[y] = value
+    current = state.current
+    following = state.next
+    data = RECORD.pack(MAGIC, VERSION, flags, *packed,
+                       current.shape_index, current.rotation, current.x, current.y,
+                       following.shape_index, following.rotation, following.x, following.y,
+                       state.score, state.level, state.lines_cleared, state.pieces_placed, state.fall_time)
+    if rng:
+        data += RNG.pack(*state.rng.getstate()[1])
+    return data
+
+
+def loads(data):
+    # The GameState a snapshot describes. Raises ValueError for anything that
+    # isn't a complete snapshot of this version.
+    if len(data) not in (SIZE, RNG_SIZE) or data[:4] != MAGIC or data[4] != VERSION:
+        raise ValueError('not a snapshot, or an unsupported version')
+    values = RECORD.unpack_from(data)
+    flags = values[2]
+    packed = values[3:3 + GRID_HEIGHT]
+    pieces = values[3 + GRID_HEIGHT:11 + GRID_HEIGHT]
+    score, level, lines_cleared, pieces_placed, fall_time = values[11 + GRID_HEIGHT:]
+    if (len(data) == RNG_SIZE) != bool(flags & HAS_RNG):
+        raise ValueError('snapshot size does not match its flags')
+
+    board = Board()
+    for y, value in enumerate(packed):
+        if value:
+            row = 0
+            cells = board.cells[y]
+            for x in range(GRID_WIDTH):
+                cell = value >> (x * CELL_BITS) & CELL_MASK
+                if cell:
+                    cells[x] = cell
+                    row |= 1 << x
+                    if not board.heights[x]:
+                        board.heights[x] = GRID_HEIGHT - y
+            board.rows[y] = row
+
+    state = GameState.__new__(GameState)
+    state.board = board
+    state.current = piece_from(*pieces[:4])
+    state.next = piece_from(*pieces[4:])
+    state.score = score
+    state.level = level
+    state.lines_cleared = lines_cleared
+    state.pieces_placed = pieces_placed
+    state.fall_time = fall_time
+    state.paused = bool(flags & PAUSED)
+    state.game_over = bool(flags & GAME_OVER)
+    # Without the generator state the pieces after `next` come from a fresh seed
+    state.rng = random.Random()
+    if flags & HAS_RNG:
+        state.rng.setstate((3, RNG.unpack_from(data, SIZE), None))
+    return state
+
+
+def piece_from(shape_index, rotation, x, y):
+    if not 0 <= shape_index < len(PIECES):
+        raise ValueError(f'bad shape index {shape_index} in snapshot')
+    piece = Tetromino(shape_index)
+    piece.rotation = rotation
+    piece.x = x
+    piece.y = y
+    return piece
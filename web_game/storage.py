@@ -0,0 +1,70 @@
+# Persistent storage for small binary blobs by key. Under pygbag this is the
+# browser's localStorage, which only holds strings, so values are kept as
+# base64; elsewhere each key is a file in the user's data directory, kept out
+# of the game's folder so a player's saves are never packaged with it.
+import base64
+import os
+import sys
+
+DATA_HOME = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+SAVE_DIR = os.path.join(DATA_HOME, 'tetris')
+KEY_PREFIX = 'tetris.'
+
+
+def browser_storage():
+    if sys.platform != 'emscripten':
+        return None
+    import platform
+    return platform.window.localStorage
+
+
+def path(key):
+    return os.path.join(SAVE_DIR, key)
+
+
+def read(key):
+    # The stored bytes, or None if there are none
+    local = browser_storage()
+    if local is not None:
+        text = local.getItem(KEY_PREFIX + key)
+        return base64.b64decode(str(text)) if text else None
+    try:
+        with open(path(key), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def write(key, data):
+    local = browser_storage()
+    if local is not None:
+        local.setItem(KEY_PREFIX + key, base64.b64encode(data).decode('ascii'))
+        return
+    # Written aside and renamed into place, so a crash never leaves half a file
+    os.makedirs(SAVE_DIR, exist_ok=True)
+    temp = path(key) + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path(key))
+
+
+def append(key, data):
+    # Adds to the end of what's stored; localStorage can only replace a value whole
+    local = browser_storage()
+    if local is not None:
+        write(key, (read(key) or b'') + data)
+        return
+    os.makedirs(SAVE_DIR, exist_ok=True)
+    with open(path(key), 'ab') as f:
+        f.write(data)
+
+
+def remove(key):
+    local = browser_storage()
+    if local is not None:
+        local.removeItem(KEY_PREFIX + key)
+        return
+    try:
+        os.remove(path(key))
+    except FileNotFoundError:
+        pass
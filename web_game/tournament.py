@@ -0,0 +1,166 @@
+# Headless self-play across all cores. Every policy plays the same seeded games
+# so results compare like for like, and results are folded into the report as
+# each chunk of games finishes.
+#
+#   python tournament.py --games 10000 --policy default --policy greedy:lookahead=0 \
+#       --policy tuned:holes=-0.5,bumpiness=-0.25 --output results.jsonl
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from engine import GRID_WIDTH, PIECES
+from game import GameState, step, HARD_DROP, MOVE_LEFT, MOVE_RIGHT, ROTATE
+from bot import Bot
+
+# Bots are kept per worker process so their transposition tables stay warm
+_bots = {}
+
+
+def parse_policy(text):
+    # NAME[:key=value,...] where keys are heuristic weights, lookahead or beam.
+    # The name 'random' plays random drops instead of searching.
+    name, _, options = text.partition(':')
+    spec = {'name': name, 'weights': {}, 'lookahead': True, 'beam': 6}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        if key == 'lookahead':
+            spec['lookahead'] = value not in ('0', 'false', 'no')
+        elif key == 'beam':
+            spec['beam'] = int(value)
+        else:
+            spec['weights'][key] = float(value)
+    return spec
+
+
+def random_plan(state, rng):
+    # Turn and shift the piece at random, then drop it
+    actions = [ROTATE] * rng.randrange(len(PIECES[state.current.shape_index]))
+    shift = rng.randrange(-GRID_WIDTH // 2, GRID_WIDTH // 2 + 1)
+    actions += [MOVE_LEFT if shift < 0 else MOVE_RIGHT] * abs(shift)
+    return actions + [HARD_DROP]
+
+
+def play_game(spec, seed, max_pieces):
+    state = GameState(seed)
+    if spec['name'] == 'random':
+        rng = random.Random(seed)
+        plan = lambda state: random_plan(state, rng)
+    else:
+        key = json.dumps(spec, sort_keys=True)
+        bot = _bots.get(key)
+        if bot is None:
+            bot = _bots[key] = Bot(spec['weights'], spec['lookahead'], spec['beam'])
+        plan = bot.plan
+
+    start = time.perf_counter()
+    while not state.game_over and state.pieces_placed < max_pieces:
+        for action in plan(state):
+            step(state, action, 0)
+    return {'policy': spec['name'], 'seed': seed, 'score': state.score, 'lines': state.lines_cleared,
+            'level': state.level, 'pieces': state.pieces_placed, 'topped_out': state.game_over,
+            'seconds': time.perf_counter() - start}
+
+
+def play_chunk(specs, seeds, max_pieces):
+    # One task: every policy plays every seed in the chunk
+    return [[play_game(spec, seed, max_pieces) for spec in specs] for seed in seeds]
+
+
+class Report:
+    def __init__(self, names):
+        self.names = names
+        self.games = 0
+        self.totals = {name: {'games': 0, 'score': 0, 'lines': 0, 'level': 0, 'pieces': 0,
+                              'topped_out': 0, 'seconds': 0.0, 'best': 0, 'wins': 0}
+                       for name in names}
+
+    def add(self, results):
+        # results: one record per policy for the same seed
+        self.games += 1
+        best_score = max(result['score'] for result in results)
+        winners = [result for result in results if result['score'] == best_score]
+        for result in results:
+            total = self.totals[result['policy']]
+            total['games'] += 1
+            for key in ('score', 'lines', 'level', 'pieces', 'seconds'):
+                total[key] += result[key]
+            total['topped_out'] += result['topped_out']
+            total['best'] = max(total['best'], result['score'])
+            # Ties are not counted as wins
+            if len(winners) == 1 and winners[0] is result:
+                total['wins'] += 1
+
+    def lines_out(self):
+        yield f"{'policy':<16}{'games':>8}{'wins':>8}{'score':>12}{'best':>10}{'lines':>9}{'level':>7}{'pieces':>9}{'topped':>8}{'ms/game':>9}"
+        for name in self.names:
+            total = self.totals[name]
+            games = max(1, total['games'])
+            yield (f"{name:<16}{total['games']:>8}{total['wins']:>8}{total['score'] / games:>12.1f}{total['best']:>10}"
+                   f"{total['lines'] / games:>9.1f}{total['level'] / games:>7.2f}{total['pieces'] / games:>9.1f}"
+                   f"{total['topped_out'] / games:>8.1%}{total['seconds'] * 1000 / games:>9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run headless bot games in parallel and report the results.')
+    parser.add_argument('--games', type=int, default=100, help='number of seeds; every policy plays each one')
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--policy', action='append', default=[], help='NAME[:key=value,...], may be repeated')
+    parser.add_argument('--max-pieces', type=int, default=1000, help='stop a game after this many pieces')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk', type=int, default=4, help='seeds per task')
+    parser.add_argument('--output', help='write one JSON line per game as results arrive')
+    parser.add_argument('--progress', type=float, default=5.0, help='seconds between progress reports')
+    args = parser.parse_args(argv)
+
+    specs = [parse_policy(text) for text in args.policy or ['default']]
+    names = [spec['name'] for spec in specs]
+    if len(set(names)) != len(names):
+        parser.error('policy names must be unique')
+
+    report = Report(names)
+    output = open(args.output, 'w') if args.output else None
+    seeds = iter(range(args.first_seed, args.first_seed + args.games))
+    start = last_progress = time.perf_counter()
+
+    with ProcessPoolExecutor(args.workers) as pool:
+        pending = set()
+
+        def submit():
+            # Keep a bounded number of tasks in flight instead of queueing every game
+            while len(pending) < args.workers * 4:
+                chunk = [seed for _, seed in zip(range(args.chunk), seeds)]
+                if not chunk:
+                    return
+                pending.add(pool.submit(play_chunk, specs, chunk, args.max_pieces))
+
+        submit()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                for results in future.result():
+                    report.add(results)
+                    if output:
+                        for result in results:
+                            output.write(json.dumps(result) + '\n')
+            submit()
+
+            now = time.perf_counter()
+            if now - last_progress >= args.progress:
+                last_progress = now
+                print(f"{report.games}/{args.games} seeds, {report.games / (now - start):.1f} seeds/s", file=sys.stderr)
+
+    if output:
+        output.close()
+    elapsed = time.perf_counter() - start
+    for line in report.lines_out():
+        print(line)
+    print(f"{report.games} seeds x {len(specs)} policies in {elapsed:.1f}s with {args.workers} workers")
+
+
+if __name__ == '__main__':
+    main()